@@ -0,0 +1,154 @@
+import argparse
+import time
+
+import numpy as np
+
+from retrieval import normalize_rows, top_k
+
+# -----------------------------
+# IVF-flat approximate nearest-neighbour engine (pure NumPy)
+# -----------------------------
+def spherical_kmeans(vectors, nlist, iters=20, seed=0):
+    """Cluster L2-normalized rows by cosine similarity. Returns (centroids, assignment)."""
+    rng = np.random.default_rng(seed)
+    n = vectors.shape[0]
+    nlist = max(1, min(nlist, n))
+    centroids = vectors[rng.choice(n, nlist, replace=False)].copy()
+    assign = np.zeros(n, dtype=np.int32)
+    for _ in range(iters):
+        assign = np.argmax(vectors @ centroids.T, axis=1).astype(np.int32)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        counts = np.bincount(assign, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            # Reseed empty lists with random points so every list stays usable
+            sums[empty] = vectors[rng.choice(n, int(empty.sum()), replace=False)]
+        centroids = normalize_rows(sums).astype(np.float32)
+    assign = np.argmax(vectors @ centroids.T, axis=1).astype(np.int32)
+    return centroids, assign
+
+
+class IVFIndex:
+    """Inverted-file index: k-means centroids plus per-list row ids.
+
+    Rows are grouped by nearest centroid (CSR layout: ``order`` holds row ids
+    sorted by list, ``offsets`` the list boundaries). A query scores only the
+    rows in its ``nprobe`` closest lists against the base vector matrix.
+    ``index_version`` records the corpus it was built on (RetrievalIndex.fingerprint),
+    so a file left over from an older index is refused instead of searched.
+    """
+
+    def __init__(self, centroids, order, offsets, nprobe=8, index_version=None):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.order = np.asarray(order, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.nprobe = nprobe
+        self.index_version = index_version
+
+    @classmethod
+    def build(cls, vectors, nlist=None, iters=20, seed=0, nprobe=8, index_version=None):
+        n = vectors.shape[0]
+        if nlist is None:
+            nlist = max(1, int(4 * np.sqrt(n)))
+        centroids, assign = spherical_kmeans(vectors, nlist, iters=iters, seed=seed)
+        order = np.argsort(assign, kind="stable")
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=len(centroids)), out=offsets[1:])
+        return cls(centroids, order, offsets, nprobe=nprobe, index_version=index_version)
+
+    @property
+    def nlist(self):
+        return self.centroids.shape[0]
+
+    @property
+    def ntotal(self):
+        return self.order.shape[0]
+
+    def save(self, path):
+        np.savez(path, centroids=self.centroids, order=self.order, offsets=self.offsets,
+                 index_version=np.array(self.index_version or ""))
+
+    @classmethod
+    def load(cls, path, nprobe=8):
+        with np.load(path) as data:
+            # Files written before index_version was recorded load as None and are refused by attach_ann
+            version = str(data["index_version"]) if "index_version" in data.files else ""
+            return cls(data["centroids"], data["order"], data["offsets"], nprobe=nprobe, index_version=version or None)
+
+    def candidates(self, query, nprobe=None):
+        """Row ids in the nprobe lists closest to a normalized query."""
+        nprobe = nprobe or self.nprobe
+        lists, _ = top_k(self.centroids @ query, nprobe)
+        return np.concatenate([self.order[self.offsets[l]:self.offsets[l + 1]] for l in lists])
+
+    def search(self, vectors, query, k, min_score=None, nprobe=None):
+        cand = self.candidates(query, nprobe)
+        ids, scores = top_k(vectors[cand] @ query, k, min_score)
+        return cand[ids], scores
+
+
+def recall_at_k(vectors, ivf, queries, k=5, nprobe=None):
+    """Mean fraction of exact top-k ids that the IVF search also returns."""
+    hits = 0
+    for q in queries:
+        exact, _ = top_k(vectors @ q, k)
+        approx, _ = ivf.search(vectors, q, k, nprobe=nprobe)
+        hits += len(np.intersect1d(exact, approx))
+    return hits / (len(queries) * k)
+
+
+# -----------------------------
+# Offline build / recall check: python ann.py {build,recall}
+# -----------------------------
+def load_vectors(index_dir, embeddings):
+    """(normalized float vectors, corpus fingerprint), memory-mapped from the index directory when it exists."""
+    import index_store
+
+    if index_store.exists(index_dir):
+        manifest = index_store.read_manifest(index_dir)
+        return index_store.read_vectors(index_dir, ["float"], manifest=manifest)["float"], manifest["index_version"]
+    import joblib
+    from retrieval import RetrievalIndex
+
+    index = RetrievalIndex.from_dataframe(joblib.load(embeddings))
+    return index.vectors, index.fingerprint
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or evaluate the IVF retrieval index.")
+    parser.add_argument("command", choices=["build", "recall"])
+    parser.add_argument("--index", default="index", help="index directory (preferred when present)")
+    parser.add_argument("--embeddings", default="embeddings.joblib", help="fallback when --index is absent")
+    parser.add_argument("--out", default="embeddings.ivf.npz")
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200, help="corpus rows sampled as recall queries")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    vectors, version = load_vectors(args.index, args.embeddings)
+    if args.command == "build":
+        ivf = IVFIndex.build(vectors, nlist=args.nlist, index_version=version)
+        ivf.save(args.out)
+        print(f"Saved IVF index with {ivf.nlist} lists over {ivf.ntotal} rows of index {version} to {args.out}")
+        return
+
+    ivf = IVFIndex.load(args.out)
+    if ivf.index_version != version:
+        print(f"Warning: {args.out} was built for index {ivf.index_version}, not {version}; rebuild it.")
+    rng = np.random.default_rng(0)
+    sample = vectors[rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)]
+    print(f"nlist={ivf.nlist} rows={ivf.ntotal} k={args.k}")
+    print("nprobe  recall@k  avg_ms")
+    for nprobe in args.nprobe:
+        recall = recall_at_k(vectors, ivf, sample, k=args.k, nprobe=nprobe)
+        start = time.perf_counter()
+        for q in sample:
+            ivf.search(vectors, q, args.k, nprobe=nprobe)
+        ms = (time.perf_counter() - start) * 1000 / len(sample)
+        print(f"{nprobe:>6}  {recall:8.3f}  {ms:6.3f}")
+
+
+if __name__ == "__main__":
+    main()
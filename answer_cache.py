@@ -0,0 +1,109 @@
+import threading
+import time
+
+import numpy as np
+
+from retrieval import normalize_query
+
+# -----------------------------
+# Semantic answer cache keyed on query embeddings
+# -----------------------------
+class SemanticAnswerCache:
+    """Reuses chat answers for questions whose embeddings are near-duplicates.
+
+    Cached query vectors live in one preallocated float32 matrix, so a lookup is
+    a single matrix-vector product over at most ``max_entries`` rows. A hit
+    needs cosine similarity >= ``threshold``, the same index version and the
+    same retrieval parameters; the least recently used entry is evicted when
+    the cache is full. The matrix is allocated on the first put, sized to the
+    embedding dimension seen.
+    """
+
+    def __init__(self, max_entries=512, threshold=0.95, ttl=3600):
+        self.dim = None
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._vectors = None
+        self._entries = [None] * max_entries
+        self._used = np.zeros(max_entries, dtype=np.float64)
+        self._lock = threading.Lock()
+
+    def lookup(self, query_embedding, index_version, params=None):
+        """Cached (answer, chunks) for a near-duplicate question, or None."""
+        query = normalize_query(query_embedding)
+        now = time.time()
+        with self._lock:
+            if query.shape[0] != self.dim:
+                self.misses += 1
+                return None
+            sims = self._vectors @ query
+            for slot in np.argsort(sims)[::-1]:
+                if sims[slot] < self.threshold:
+                    break
+                entry = self._entries[slot]
+                if entry is None or entry["expires"] < now:
+                    continue
+                if entry["version"] != index_version or entry["params"] != params:
+                    continue
+                self._used[slot] = now
+                self.hits += 1
+                return entry["answer"], entry["chunks"]
+            self.misses += 1
+            return None
+
+    def put(self, query_embedding, answer, chunks, index_version, params=None):
+        query = normalize_query(query_embedding)
+        now = time.time()
+        with self._lock:
+            if query.shape[0] != self.dim:
+                # First entry, or the embedding model changed: start a fresh matrix
+                self.dim = query.shape[0]
+                self._vectors = np.zeros((self.max_entries, self.dim), dtype=np.float32)
+                self._entries = [None] * self.max_entries
+                self._used[:] = 0
+            free = [i for i, e in enumerate(self._entries) if e is None or e["expires"] < now]
+            if free:
+                slot = free[0]
+            else:
+                slot = int(np.argmin(self._used))
+                self.evictions += 1
+            self._vectors[slot] = query
+            self._entries[slot] = {
+                "answer": answer,
+                "chunks": chunks,
+                "version": index_version,
+                "params": params,
+                "expires": now + self.ttl,
+            }
+            self._used[slot] = now
+
+    def clear(self):
+        """Drop every entry (called when the retrieval index is swapped)."""
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors[:] = 0
+            self._entries = [None] * self.max_entries
+            self._used[:] = 0
+            self.invalidations += 1
+
+    def __len__(self):
+        return sum(e is not None for e in self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,306 @@
+import asyncio
+import logging
+
+from quart import Quart, Response, render_template, request
+
+import cohere_client
+import main
+import metrics
+from batching import AsyncMicroBatcher
+from cache import SqliteCache
+
+# -----------------------------
+# Async serving mode: uvicorn asgi:app --workers 2
+# -----------------------------
+# Same pages, routes and index as main.py, but upstream Cohere calls are
+# awaited on a pooled httpx.AsyncClient, so one worker keeps hundreds of
+# questions in flight while they wait on the network. Retrieval, caches and
+# the hot-reloading index are shared with main.py; CPU-bound search runs in a
+# thread so it never blocks the event loop.
+logger = logging.getLogger(__name__)
+
+app = Quart(__name__)
+app.add_template_filter(main.format_timestamp, "format_timestamp")
+
+cohere = cohere_client.from_env(main.COHERE_API_KEY, asynchronous=True)
+
+
+@app.after_serving
+async def close_cohere():
+    await cohere.aclose()
+
+
+# -----------------------------
+# Async Cohere calls (same (result, error) contract as main.py; rate limits are charged per attempt by
+# main.upstream, with the limiter's SQLite transactions run in a thread)
+# -----------------------------
+async def request_embeddings(text_list, input_type="search_query"):
+    data = {"model": main.COHERE_EMBED_MODEL, "texts": text_list, "input_type": input_type}
+    try:
+        r = await main.upstream.acall("embed", lambda: cohere.post(main.COHERE_EMBED_URL, data),
+                                      hedge=main.HEDGE_EMBED, cost={"embed": 1})
+        if r.status_code in (429, 402):
+            logger.warning("Cohere embed API returned status %s", r.status_code)
+            return None, "API limit reached or billing required."
+        r.raise_for_status()
+        return r.json()["embeddings"], None
+    except main.CircuitOpenError:
+        return None, main.UNAVAILABLE_MESSAGE
+    except main.RateLimited:
+        return None, main.RATE_LIMITED_MESSAGE
+    except Exception as e:
+        logger.exception("Error calling Cohere embed API")
+        return None, f"Cohere embedding error: {e}"
+
+
+embed_batcher = None
+if main.EMBED_BATCH_WINDOW_MS > 0:
+    embed_batcher = AsyncMicroBatcher(request_embeddings, max_batch=main.EMBED_BATCH_MAX,
+                                      window=main.EMBED_BATCH_WINDOW_MS / 1000)
+
+
+async def cache_call(cache, fn, *args):
+    """fn(*args) against ``cache``; in a thread when it is SQLite-backed, so a slow disk never stalls the loop."""
+    if isinstance(cache, SqliteCache):
+        return await asyncio.to_thread(fn, *args)
+    return fn(*args)
+
+
+async def create_embedding(text_list, input_type="search_query"):
+    keys, embeddings, missing = await cache_call(main.embed_cache, main.cached_embeddings, text_list, input_type)
+    if missing:
+        texts = [text_list[i] for i in missing]
+        if embed_batcher is not None and input_type == "search_query":
+            fetched, error = await embed_batcher.submit_many(texts)
+        else:
+            fetched, error = await request_embeddings(texts, input_type)
+        if error:
+            return None, error
+        await cache_call(main.embed_cache, main.store_embeddings, keys, embeddings, missing, fetched)
+    return embeddings, None
+
+
+async def inference_cohere(messages):
+    data = {"model": main.COHERE_CHAT_MODEL, "messages": messages, "temperature": 0.2}
+    try:
+        r = await main.upstream.acall("chat", lambda: cohere.post(main.COHERE_CHAT_URL, data),
+                                      cost=main.chat_cost(messages))
+        if r.status_code in (429, 402):
+            logger.warning("Cohere chat API returned status %s", r.status_code)
+            return None, "API limit reached or billing required."
+        r.raise_for_status()
+        response = r.json()
+        await asyncio.to_thread(main.charge_output_tokens, response.get("usage"))
+        return response["message"]["content"][0]["text"].strip(), None
+    except main.CircuitOpenError:
+        return None, main.UNAVAILABLE_MESSAGE
+    except main.RateLimited:
+        return None, main.RATE_LIMITED_MESSAGE
+    except Exception as e:
+        logger.exception("Error calling Cohere chat API")
+        return None, f"Cohere chat error: {e}"
+
+
+async def stream_inference_cohere(messages):
+    data = {"model": main.COHERE_CHAT_MODEL, "messages": messages, "temperature": 0.2, "stream": True}
+    events = main.upstream.astream("chat", lambda: cohere.stream(main.COHERE_CHAT_URL, data),
+                                   cost=main.chat_cost(messages))
+    async for event in events:
+        if event.get("type") == "content-delta":
+            yield event["delta"]["message"]["content"]["text"]
+        elif event.get("type") == "message-end":
+            await asyncio.to_thread(main.charge_output_tokens, event.get("delta", {}).get("usage"))
+
+
+async def prepare_answer(incoming_query, form):
+    plan, error = main.start_plan(form)
+    if error:
+        return None, error
+    with metrics.stage("embed"):
+        question_embedding, error = await create_embedding([incoming_query])
+    if error:
+        return None, error
+    # to_thread copies the context, so finish_plan's stages land on this request's timer
+    return await asyncio.to_thread(main.finish_plan, plan, incoming_query, question_embedding[0])
+
+
+async def answer_question(incoming_query, form):
+    plan, error = await prepare_answer(incoming_query, form)
+    if error:
+        return None, error
+    if plan["answer"] is not None:
+        return plan["answer"], None
+    with metrics.stage("chat"):
+        response, error = await inference_cohere(plan["messages"])
+    if error:
+        return None, error
+    main.remember_answer(plan, response)
+    return response, None
+
+
+async def coalesced_answer(incoming_query, form):
+    if main.inflight is None:
+        return await answer_question(incoming_query, form)
+    return await main.inflight.ado(main.coalesce_key(incoming_query, form),
+                                   lambda: answer_question(incoming_query, form))
+
+
+async def stream_answer(incoming_query, form, outcome):
+    """Async main.stream_answer(); the answer (None on error) is left in outcome["answer"]."""
+    plan, error = await prepare_answer(incoming_query, form)
+    if error:
+        yield main.sse_event("error", {"message": error})
+        return
+    if plan["answer"] is not None:
+        for event in main.replay_answer(plan["answer"]):
+            yield event
+        outcome["answer"] = plan["answer"]
+        return
+    parts = []
+    try:
+        with metrics.stage("chat"):
+            async for text in stream_inference_cohere(plan["messages"]):
+                parts.append(text)
+                yield main.sse_event("token", {"text": text})
+    except Exception as e:
+        logger.exception("Error streaming Cohere chat API")
+        yield main.sse_event("error", {"message": main.cohere_error_message(e, "chat")})
+        return
+    answer = "".join(parts).strip()
+    main.remember_answer(plan, answer)
+    yield main.sse_event("done", {"answer": answer, "cached": False, "timings": metrics.timings()})
+    outcome["answer"] = answer
+
+
+async def coalesced_stream(incoming_query, form):
+    inflight = main.inflight
+    key = main.coalesce_key(incoming_query, form)
+    flight, leader = inflight.abegin(key)
+    if not leader:
+        result = await inflight.await_(flight)
+        if result is not None:
+            for event in main.replay_answer(result[0]):
+                yield event
+        else:
+            async for event in stream_answer(incoming_query, form, {}):
+                yield event
+        return
+    outcome = {"answer": None}
+    try:
+        # No host lock while streaming, see main.coalesced_stream()
+        shared = await inflight.alookup(key)
+        if shared is not None:
+            outcome["answer"] = shared
+            for event in main.replay_answer(shared):
+                yield event
+            return
+        async for event in stream_answer(incoming_query, form, outcome):
+            yield event
+        if outcome["answer"] is not None:
+            await inflight.apublish(key, outcome["answer"])
+    finally:
+        answer = outcome["answer"]
+        inflight.afinish(key, flight, (answer, None) if answer is not None else None)
+
+
+# -----------------------------
+# Routes
+# -----------------------------
+@app.before_request
+async def start_request_timer():
+    metrics.start_request(request.url_rule.rule if request.url_rule else "unmatched")
+
+
+@app.after_request
+async def finish_request_timer(response):
+    timer = metrics.current()
+    if timer is not None and not timer.streaming:
+        response.headers["Server-Timing"] = timer.server_timing()
+        # The on_request_finished hooks may write a metrics snapshot (SQLite counts, a JSON file)
+        await asyncio.to_thread(timer.finish, response.status_code)
+    return response
+
+
+@app.teardown_request
+async def clear_request_timer(exc):
+    metrics.end_request()
+
+
+@app.route("/metrics")
+async def metrics_endpoint():
+    return Response(await asyncio.to_thread(main.metrics_text), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/health")
+async def health():
+    return "OK", 200
+
+
+@app.route("/ready")
+async def ready():
+    return main.readiness()
+
+
+@app.route("/", methods=["GET", "POST"])
+async def result():
+    response = None
+    incoming_query = ""
+
+    if request.method == "POST":
+        form = await request.form
+        incoming_query = form.get("queryInput", "").strip()
+        if not incoming_query:
+            return await render_page("Please enter a question.", "")
+
+        response, error = await coalesced_answer(incoming_query, form)
+        if error:
+            return await render_page(error, incoming_query)
+
+    return await render_page(response, incoming_query)
+
+
+async def render_page(answer, query):
+    with metrics.stage("render"):
+        return await render_template("index.html", answer=answer, query=query)
+
+
+@app.route("/stream", methods=["POST"])
+async def stream_result():
+    form = await request.form
+    incoming_query = form.get("queryInput", "").strip()
+    if not incoming_query:
+        events = [main.sse_event("error", {"message": "Please enter a question."})]
+    elif main.inflight is None:
+        events = metrics.aiterate_with(metrics.current(), stream_answer(incoming_query, form, {}))
+    else:
+        events = metrics.aiterate_with(metrics.current(), coalesced_stream(incoming_query, form))
+    return Response(events, mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/admin/index", methods=["GET"])
+async def admin_index():
+    if not main.admin_authorized(request.headers):
+        return {"error": "unauthorized"}, 401
+    return main.index_manager.status()
+
+
+@app.route("/admin/cache", methods=["GET"])
+async def admin_cache():
+    if not main.admin_authorized(request.headers):
+        return {"error": "unauthorized"}, 401
+    return await asyncio.to_thread(main.cache_stats)
+
+
+@app.route("/admin/upstream", methods=["GET"])
+async def admin_upstream():
+    if not main.admin_authorized(request.headers):
+        return {"error": "unauthorized"}, 401
+    return {**main.upstream_stats(), "embed_batching": embed_batcher.stats() if embed_batcher else None}
+
+
+@app.route("/admin/index/reload", methods=["POST"])
+async def admin_index_reload():
+    if not main.admin_authorized(request.headers):
+        return {"error": "unauthorized"}, 401
+    return await asyncio.to_thread(main.reload_index, request.args)
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Micro-batching: group items submitted within a short window into one call
+# -----------------------------
+class _Slot:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _run(process, items):
+    """process(items) -> (results, error), with unexpected exceptions turned into an error."""
+    try:
+        results, error = process(items)
+    except Exception as e:
+        logger.exception("Batched call failed")
+        return None, f"{type(e).__name__}: {e}"
+    if error is None and len(results) != len(items):
+        return None, f"Batched call returned {len(results)} results for {len(items)} items."
+    return results, error
+
+
+class MicroBatcher:
+    """Collects items from concurrent threads and hands them to ``process`` in batches.
+
+    ``process(items)`` returns ``(results, error)`` with one result per item.
+    The first caller to find no batch forming becomes the leader: it waits up
+    to ``window`` seconds (less if ``max_batch`` items arrive), takes everything
+    pending and runs ``process`` on chunks of at most ``max_batch``. The other
+    callers block until their results are in. Nothing runs in the background,
+    so it is safe across gunicorn's fork.
+    """
+
+    def __init__(self, process, max_batch=96, window=0.01):
+        self.process = process
+        self.max_batch = max_batch
+        self.window = window
+        self.batches = 0
+        self.items = 0
+        self.largest = 0
+        self._pending = []
+        self._collecting = False
+        self._cond = threading.Condition()
+
+    def submit(self, item):
+        """(result, error) for one item."""
+        results, error = self.submit_many([item])
+        return (results[0] if results else None), error
+
+    def submit_many(self, items):
+        """(results, error) for several items (all from one caller, batched with everyone else's)."""
+        slots = [_Slot() for _ in items]
+        with self._cond:
+            self._pending.extend(zip(items, slots))
+            leader = not self._collecting
+            self._collecting = True
+            if len(self._pending) >= self.max_batch:
+                self._cond.notify_all()
+        if leader:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._pending) >= self.max_batch, timeout=self.window)
+                pending, self._pending = self._pending, []
+                self._collecting = False
+            self._flush(pending)
+        for slot in slots:
+            slot.done.wait()
+        errors = [slot.error for slot in slots if slot.error]
+        if errors:
+            return None, errors[0]
+        return [slot.result for slot in slots], None
+
+    def _flush(self, pending):
+        for i in range(0, len(pending), self.max_batch):
+            chunk = pending[i:i + self.max_batch]
+            results, error = _run(self.process, [item for item, _ in chunk])
+            self._record(len(chunk))
+            for j, (_, slot) in enumerate(chunk):
+                if error:
+                    slot.error = error
+                else:
+                    slot.result = results[j]
+                slot.done.set()
+
+    def _record(self, size):
+        with self._cond:
+            self.batches += 1
+            self.items += size
+            self.largest = max(self.largest, size)
+
+    def stats(self):
+        return {
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch,
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch": self.items / self.batches if self.batches else 0.0,
+            "largest_batch": self.largest,
+        }
+
+
+class AsyncMicroBatcher(MicroBatcher):
+    """MicroBatcher for one event loop: ``process`` is a coroutine function and
+    a timer, not a waiting leader, flushes the window."""
+
+    def __init__(self, process, max_batch=96, window=0.01):
+        super().__init__(process, max_batch, window)
+        self._timer = None
+
+    async def submit(self, item):
+        results, error = await self.submit_many([item])
+        return (results[0] if results else None), error
+
+    async def submit_many(self, items):
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in items]
+        self._pending.extend(zip(items, futures))
+        if len(self._pending) >= self.max_batch:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._start_flush)
+        outcomes = await asyncio.gather(*futures)
+        errors = [error for _, error in outcomes if error]
+        if errors:
+            return None, errors[0]
+        return [result for result, _ in outcomes], None
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        for i in range(0, len(pending), self.max_batch):
+            asyncio.ensure_future(self._aflush(pending[i:i + self.max_batch]))
+
+    async def _aflush(self, chunk):
+        try:
+            results, error = await self.process([item for item, _ in chunk])
+        except Exception as e:
+            logger.exception("Batched call failed")
+            results, error = None, f"{type(e).__name__}: {e}"
+        if error is None and len(results) != len(chunk):
+            error = f"Batched call returned {len(results)} results for {len(chunk)} items."
+        self._record(len(chunk))
+        for j, (_, future) in enumerate(chunk):
+            if not future.done():
+                future.set_result((None, error) if error else (results[j], None))
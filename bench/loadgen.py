@@ -0,0 +1,215 @@
+import argparse
+import json
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# -----------------------------
+# Load generator: fixed QPS (open loop) or fixed concurrency (closed loop) against the app
+# -----------------------------
+DEFAULT_QUESTIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "questions.txt")
+
+# The app renders failures into a 200 page, so "/" answers are checked for its error messages
+ERROR_MARKERS = (
+    "Cohere is temporarily unavailable",
+    "Too many questions right now",
+    "API limit reached or billing required",
+    "Cohere embedding error",
+    "Cohere chat error",
+    "The lecture index is still loading",
+    "Embeddings not loaded",
+    "Error computing similarity",
+)
+
+
+class Result:
+    __slots__ = ("started", "latency", "first_byte", "status", "error")
+
+    def __init__(self, started, latency, first_byte=None, status=None, error=None):
+        self.started = started
+        self.latency = latency
+        self.first_byte = first_byte
+        self.status = status
+        self.error = error
+
+
+def load_questions(path=None):
+    with open(path or DEFAULT_QUESTIONS, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+class Target:
+    """One request against the app: POST a question to "/" or "/stream", or GET any other path.
+
+    With ``unique_fraction`` > 0 that share of questions gets a random suffix, so
+    it misses the embedding and answer caches; the rest repeat from the list.
+    """
+
+    def __init__(self, base_url, endpoint="/", questions=None, unique_fraction=0.0, timeout=60.0):
+        self.base_url = base_url.rstrip("/")
+        self.endpoint = endpoint
+        self.questions = questions or load_questions()
+        self.unique_fraction = unique_fraction
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def question(self):
+        question = random.choice(self.questions)
+        if random.random() < self.unique_fraction:
+            question = f"{question} ({uuid.uuid4().hex[:8]})"
+        return question
+
+    def __call__(self, scheduled):
+        """Send one request; latency counts from ``scheduled`` (its planned start), not from when it went out."""
+        url = self.base_url + self.endpoint
+        try:
+            if self.endpoint == "/stream":
+                return self._stream(url, scheduled)
+            if self.endpoint == "/":
+                r = self.session.post(url, data={"queryInput": self.question()}, timeout=self.timeout)
+            else:
+                r = self.session.get(url, timeout=self.timeout)
+            latency = time.perf_counter() - scheduled
+            error = None
+            if r.status_code >= 400:
+                error = f"HTTP {r.status_code}"
+            elif self.endpoint == "/":
+                error = next((m for m in ERROR_MARKERS if m in r.text), None)
+            return Result(scheduled, latency, status=r.status_code, error=error)
+        except requests.RequestException as e:
+            return Result(scheduled, time.perf_counter() - scheduled, error=type(e).__name__)
+
+    def _stream(self, url, scheduled):
+        first_byte = error = None
+        with self.session.post(url, data={"queryInput": self.question()}, stream=True, timeout=self.timeout) as r:
+            if r.status_code >= 400:
+                error = f"HTTP {r.status_code}"
+            for line in r.iter_lines(decode_unicode=True):
+                if line.startswith("event: token") and first_byte is None:
+                    first_byte = time.perf_counter() - scheduled
+                elif line.startswith("event: error"):
+                    error = "stream error event"
+            return Result(scheduled, time.perf_counter() - scheduled, first_byte, r.status_code, error)
+
+
+def run_fixed_qps(target, rate, duration, max_in_flight=512):
+    """Open loop: start ``rate`` requests per second regardless of how fast they finish."""
+    futures = []
+    interval = 1.0 / rate
+    with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="loadgen") as pool:
+        start = time.perf_counter()
+        i = 0
+        while True:
+            scheduled = start + i * interval
+            if scheduled - start >= duration:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(pool.submit(target, scheduled))
+            i += 1
+    return [f.result() for f in futures]
+
+
+def run_fixed_concurrency(target, concurrency, duration):
+    """Closed loop: ``concurrency`` clients, each sending its next request when the last one finishes."""
+    results = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        while time.perf_counter() < deadline:
+            result = target(time.perf_counter())
+            with lock:
+                results.append(result)
+
+    threads = [threading.Thread(target=client, name=f"client-{n}", daemon=True) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def run(target, mode="concurrency", level=8, duration=30.0, warmup=5.0):
+    """Drive ``target`` for warmup + duration seconds; results started during the warmup are dropped."""
+    runner = run_fixed_qps if mode == "qps" else run_fixed_concurrency
+    started = time.perf_counter()
+    results = runner(target, level, warmup + duration)
+    measured_from = started + warmup
+    return [r for r in results if r.started >= measured_from], duration
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    # Nearest rank: the smallest value with at least p% of the samples at or below it
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(results, duration):
+    """Latency percentiles (ms), throughput and error rate for one run."""
+    latencies = sorted(r.latency for r in results)
+    first_bytes = sorted(r.first_byte for r in results if r.first_byte is not None)
+    errors = {}
+    for r in results:
+        if r.error:
+            errors[r.error] = errors.get(r.error, 0) + 1
+    ok = len(results) - sum(errors.values())
+
+    def ms(value):
+        return round(value * 1000, 1) if value is not None else None
+
+    summary = {
+        "requests": len(results),
+        "throughput_rps": round(ok / duration, 2) if duration else None,
+        "error_rate": round(sum(errors.values()) / len(results), 4) if results else None,
+        "errors": errors,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "mean_ms": ms(sum(latencies) / len(latencies)) if latencies else None,
+        "max_ms": ms(latencies[-1]) if latencies else None,
+    }
+    if first_bytes:
+        summary["first_token_p50_ms"] = ms(percentile(first_bytes, 50))
+        summary["first_token_p95_ms"] = ms(percentile(first_bytes, 95))
+    return summary
+
+
+def add_arguments(parser):
+    parser.add_argument("--endpoint", default="/", help='"/", "/stream" or any GET path such as /health')
+    parser.add_argument("--mode", choices=("qps", "concurrency"), default="concurrency")
+    parser.add_argument("--rate", type=float, default=10, help="requests per second (--mode qps)")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients (--mode concurrency)")
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds of load before measuring")
+    parser.add_argument("--questions", default=None, help=f"one question per line (default {DEFAULT_QUESTIONS})")
+    parser.add_argument("--unique-fraction", type=float, default=0.0,
+                        help="share of questions made unique so they miss the caches")
+    parser.add_argument("--timeout", type=float, default=60)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drive the app at a fixed QPS or concurrency and report latency.")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    add_arguments(parser)
+    args = parser.parse_args()
+    target = Target(args.url, args.endpoint, load_questions(args.questions), args.unique_fraction, args.timeout)
+    level = args.rate if args.mode == "qps" else args.concurrency
+    results, duration = run(target, args.mode, level, args.duration, args.warmup)
+    print(json.dumps(summarize(results, duration), indent=2))
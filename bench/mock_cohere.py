@@ -0,0 +1,248 @@
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# -----------------------------
+# Local Cohere stand-in for load tests: /v1/embed and /v2/chat (plain and streaming)
+# -----------------------------
+WORDS = ("the vertex buffer is bound before drawing and the shader reads each attribute from it "
+         "at the location given in the layout so the depth test keeps the closest fragment").split()
+
+
+class Latency:
+    """A latency distribution parsed from "fixed:S", "uniform:LO:HI", "normal:MEAN:SD" or "lognormal:MEDIAN:SIGMA".
+
+    Values are seconds; samples are never negative.
+    """
+
+    KINDS = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}
+
+    def __init__(self, spec):
+        kind, _, rest = spec.partition(":")
+        params = [float(p) for p in rest.split(":") if p]
+        if kind not in self.KINDS or len(params) != self.KINDS[kind]:
+            raise ValueError(f"Bad latency {spec!r}; use fixed:S, uniform:LO:HI, normal:MEAN:SD "
+                             "or lognormal:MEDIAN:SIGMA.")
+        self.spec = spec
+        self.kind = kind
+        self.params = params
+
+    def sample(self, rng=random):
+        if self.kind == "fixed":
+            value = self.params[0]
+        elif self.kind == "uniform":
+            value = rng.uniform(*self.params)
+        elif self.kind == "normal":
+            value = rng.gauss(*self.params)
+        else:
+            median, sigma = self.params
+            value = median * math.exp(rng.gauss(0, sigma))
+        return max(0.0, value)
+
+    def __repr__(self):
+        return f"Latency({self.spec!r})"
+
+
+class MockSettings:
+    """What the mock does per call: latency, failure mix and answer shape."""
+
+    def __init__(self, embed_latency="lognormal:0.08:0.3", chat_latency="lognormal:0.6:0.4", token_delay=0.02,
+                 answer_tokens=120, error_rate=0.0, rate_limit_rate=0.0, retry_after=1.0, dim=1024):
+        self.embed_latency = Latency(embed_latency)
+        self.chat_latency = Latency(chat_latency)  # to the first token when streaming, whole answer otherwise
+        self.token_delay = token_delay
+        self.answer_tokens = answer_tokens
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.dim = dim
+
+
+def embedding(text, dim):
+    """Deterministic unit vector per text, so repeated questions embed identically."""
+    rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+    vector = [rng.gauss(0, 1) for _ in range(dim)]
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def answer_words(n, rng=random):
+    return [rng.choice(WORDS) for _ in range(n)]
+
+
+class MockCohere:
+    """Threaded HTTP server; counts requests and outcomes per endpoint (stats(), or GET /stats)."""
+
+    def __init__(self, settings, host="127.0.0.1", port=0):
+        self.settings = settings
+        self.counts = {}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, endpoint, outcome):
+        with self._lock:
+            per_endpoint = self.counts.setdefault(endpoint, {})
+            per_endpoint[outcome] = per_endpoint.get(outcome, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return {endpoint: dict(outcomes) for endpoint, outcomes in self.counts.items()}
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="mock-cohere", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.startswith("/stats"):
+                    return self._json(200, mock.stats())
+                return self._json(404, {"message": f"unknown path {self.path}"})
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                try:
+                    payload = json.loads(body or b"{}")
+                except ValueError:
+                    return self._json(400, {"message": "invalid JSON"})
+                if self.path.startswith("/v1/embed"):
+                    return mock._embed(self, payload)
+                if self.path.startswith("/v2/chat"):
+                    return mock._chat(self, payload)
+                return self._json(404, {"message": f"unknown path {self.path}"})
+
+            def _json(self, status, data, headers=None):
+                raw = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(raw)
+
+        return Handler
+
+    def _failure(self, handler, endpoint):
+        """Send an injected 429 or 500 (and return True), or return False to answer normally."""
+        roll = random.random()
+        if roll < self.settings.rate_limit_rate:
+            self.count(endpoint, "429")
+            handler._json(429, {"message": "rate limited (mock)"}, {"Retry-After": f"{self.settings.retry_after:g}"})
+            return True
+        if roll < self.settings.rate_limit_rate + self.settings.error_rate:
+            self.count(endpoint, "500")
+            handler._json(500, {"message": "internal error (mock)"})
+            return True
+        return False
+
+    def _embed(self, handler, payload):
+        time.sleep(self.settings.embed_latency.sample())
+        if self._failure(handler, "embed"):
+            return
+        texts = payload.get("texts") or []
+        self.count("embed", "200")
+        handler._json(200, {
+            "id": "mock",
+            "texts": texts,
+            "embeddings": [embedding(text, self.settings.dim) for text in texts],
+            "meta": {"billed_units": {"input_tokens": sum(len(t.split()) for t in texts)}},
+        })
+
+    def _chat(self, handler, payload):
+        time.sleep(self.settings.chat_latency.sample())
+        if self._failure(handler, "chat"):
+            return
+        words = answer_words(self.settings.answer_tokens)
+        usage = {"billed_units": {"input_tokens": sum(len(str(m.get("content", "")).split())
+                                                      for m in payload.get("messages", [])),
+                                  "output_tokens": len(words)}}
+        if not payload.get("stream"):
+            self.count("chat", "200")
+            return handler._json(200, {
+                "id": "mock",
+                "finish_reason": "COMPLETE",
+                "message": {"role": "assistant", "content": [{"type": "text", "text": " ".join(words)}]},
+                "usage": usage,
+            })
+        self.count("chat", "200 stream")
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Connection", "close")
+        handler.end_headers()
+        handler.close_connection = True
+        try:
+            self._sse(handler, "message-start", {"type": "message-start", "id": "mock"})
+            for i, word in enumerate(words):
+                if i:
+                    time.sleep(self.settings.token_delay)
+                self._sse(handler, "content-delta", {
+                    "type": "content-delta", "index": 0,
+                    "delta": {"message": {"content": {"text": word if i == 0 else " " + word}}},
+                })
+            self._sse(handler, "message-end", {"type": "message-end",
+                                               "delta": {"finish_reason": "COMPLETE", "usage": usage}})
+        except (BrokenPipeError, ConnectionResetError):
+            self.count("chat", "client disconnected")
+
+    @staticmethod
+    def _sse(handler, event, data):
+        handler.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+        handler.wfile.flush()
+
+
+def add_arguments(parser):
+    parser.add_argument("--embed-latency", default="lognormal:0.08:0.3", help="embed call latency distribution")
+    parser.add_argument("--chat-latency", default="lognormal:0.6:0.4",
+                        help="chat latency (to the first token when streaming)")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="seconds between streamed tokens")
+    parser.add_argument("--answer-tokens", type=int, default=120, help="words per chat answer")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of calls answered with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--dim", type=int, default=1024, help="embedding dimension (must match the index)")
+
+
+def settings_from_args(args):
+    return MockSettings(args.embed_latency, args.chat_latency, args.token_delay, args.answer_tokens,
+                        args.error_rate, args.rate_limit_rate, args.retry_after, args.dim)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for Cohere's /v1/embed and /v2/chat.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_arguments(parser)
+    args = parser.parse_args()
+    mock = MockCohere(settings_from_args(args), args.host, args.port)
+    print(f"Mock Cohere on {mock.url}: set COHERE_EMBED_URL={mock.url}/v1/embed COHERE_CHAT_URL={mock.url}/v2/chat")
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(mock.stats(), indent=2))
@@ -0,0 +1,190 @@
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+import loadgen
+
+# -----------------------------
+# Benchmark suite: for each configuration start the mock Cohere and the app, drive load, report
+# -----------------------------
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+DEFAULT_SUITE = os.path.join(BENCH_DIR, "suite.json")
+STAGES = ("embed", "answer_cache", "similarity", "topk", "prompt", "chat", "render")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def merged(base, override):
+    """Shallow merge of the suite defaults with one configuration's overrides."""
+    return {**(base or {}), **(override or {})}
+
+
+def mock_command(port, mock):
+    command = [sys.executable, os.path.join(BENCH_DIR, "mock_cohere.py"), "--port", str(port)]
+    for key, value in mock.items():
+        command += [f"--{key.replace('_', '-')}", str(value)]
+    return command
+
+
+def app_command(port, config):
+    """gunicorn (sync or gthread workers) serving main:app, or uvicorn serving asgi:app."""
+    worker_class = config.get("worker_class", "sync")
+    workers = str(config.get("workers", 2))
+    if worker_class == "uvicorn":
+        return [sys.executable, "-m", "uvicorn", "asgi:app", "--host", "127.0.0.1", "--port", str(port),
+                "--workers", workers, "--log-level", "warning"]
+    command = [sys.executable, "-m", "gunicorn", "main:app", "--bind", f"127.0.0.1:{port}", "--workers", workers,
+               "--worker-class", worker_class, "--timeout", "120", "--log-level", "warning"]
+    if worker_class == "gthread":
+        command += ["--threads", str(config.get("threads", 8))]
+    return command
+
+
+def app_env(config, env, mock_url, scratch):
+    """Environment for one app run: the suite's and configuration's settings, Cohere pointed at the mock,
+    and fresh cache / metrics / rate-limit files so configurations do not share state."""
+    return {
+        **os.environ,
+        "COHERE_API_KEY": "bench",
+        "INDEX_RELOAD_INTERVAL": "0",
+        "EMBED_CACHE_PATH": os.path.join(scratch, "query_embeddings.sqlite"),
+        "COALESCE_DIR": os.path.join(scratch, "inflight"),
+        "RATE_LIMIT_PATH": os.path.join(scratch, "ratelimit.sqlite"),
+        "METRICS_DIR": os.path.join(scratch, "metrics"),
+        "METRICS_FLUSH_INTERVAL": "1",
+        **{key: str(value) for key, value in env.items()},
+        "COHERE_EMBED_URL": f"{mock_url}/v1/embed",
+        "COHERE_CHAT_URL": f"{mock_url}/v2/chat",
+    }
+
+
+def wait_until(url, process, timeout, ok=(200,)):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{' '.join(process.args[:4])} exited with status {process.returncode}.")
+        try:
+            if requests.get(url, timeout=1).status_code in ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} not ready after {timeout}s.")
+
+
+def stop(process):
+    if process is None or process.poll() is not None:
+        return
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def stage_means(metrics_text):
+    """Mean milliseconds per stage from the app's rag_stage_seconds histogram."""
+    sums, counts = {}, {}
+    for line in metrics_text.splitlines():
+        for suffix, target in (("_sum", sums), ("_count", counts)):
+            prefix = f"rag_stage_seconds{suffix}{{stage=\""
+            if line.startswith(prefix):
+                stage = line[len(prefix):line.index('"', len(prefix))]
+                target[stage] = float(line.rsplit(" ", 1)[1])
+    return {stage: round(sums[stage] / counts[stage] * 1000, 1) for stage in sums if counts.get(stage)}
+
+
+def run_config(config, suite, log):
+    load = merged(suite.get("load"), config.get("load"))
+    mock = merged(suite.get("mock"), config.get("mock"))
+    env = merged(suite.get("env"), config.get("env"))
+    mock_port, app_port = free_port(), free_port()
+    mock_url, app_url = f"http://127.0.0.1:{mock_port}", f"http://127.0.0.1:{app_port}"
+    mock_process = app_process = None
+    with tempfile.TemporaryDirectory(prefix="bench-") as scratch:
+        try:
+            mock_process = subprocess.Popen(mock_command(mock_port, mock), stdout=log, stderr=log)
+            wait_until(f"{mock_url}/stats", mock_process, 15)
+            app_process = subprocess.Popen(app_command(app_port, config), cwd=REPO_DIR,
+                                           env=app_env(config, env, mock_url, scratch), stdout=log, stderr=log)
+            wait_until(f"{app_url}/ready", app_process, load.get("startup_timeout", 120))
+
+            target = loadgen.Target(app_url, load.get("endpoint", "/"), loadgen.load_questions(load.get("questions")),
+                                    load.get("unique_fraction", 0.0), load.get("timeout", 60))
+            mode = load.get("mode", "concurrency")
+            level = load.get("rate", 10) if mode == "qps" else load.get("concurrency", 8)
+            results, duration = loadgen.run(target, mode, level, load.get("duration", 30), load.get("warmup", 5))
+            time.sleep(1.5)  # let every worker write its metrics snapshot
+            summary = loadgen.summarize(results, duration)
+            summary["stages_ms"] = stage_means(requests.get(f"{app_url}/metrics", timeout=10).text)
+            summary["mock"] = requests.get(f"{mock_url}/stats", timeout=5).json()
+        finally:
+            stop(app_process)
+            stop(mock_process)
+    return {"name": config["name"], "server": config, "load": load, "mock_settings": mock, "env": env, **summary}
+
+
+def report(rows):
+    """Markdown table: one line per configuration."""
+    header = ["config", "load", "req", "rps", "p50 ms", "p95 ms", "p99 ms", "errors", *STAGES]
+    lines = ["| " + " | ".join(header) + " |", "|" + "---|" * len(header)]
+    for row in rows:
+        if "failed" in row:
+            lines.append(f"| {row['name']} | failed: {row['failed']} |" + " |" * (len(header) - 2))
+            continue
+        load = row["load"]
+        level = f"{load.get('rate')} qps" if load.get("mode") == "qps" else f"{load.get('concurrency')} conc"
+        stages = row.get("stages_ms", {})
+        lines.append("| " + " | ".join(str(v) for v in [
+            row["name"], f"{load.get('endpoint', '/')} {level}", row["requests"], row["throughput_rps"],
+            row["p50_ms"], row["p95_ms"], row["p99_ms"], f"{(row['error_rate'] or 0) * 100:.1f}%",
+            *(stages.get(stage, "") for stage in STAGES),
+        ]) + " |")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the load-test suite against a local Cohere stand-in.")
+    parser.add_argument("--suite", default=DEFAULT_SUITE, help="suite JSON (defaults, then one entry per config)")
+    parser.add_argument("--only", default=None, help="comma-separated configuration names to run")
+    parser.add_argument("--duration", type=float, default=None, help="override every configuration's duration")
+    parser.add_argument("--out", default=None, help="also write the full results as JSON here")
+    parser.add_argument("--log", default=os.devnull, help="file for the app's and mock's output")
+    args = parser.parse_args()
+
+    with open(args.suite, encoding="utf-8") as f:
+        suite = json.load(f)
+    wanted = set(args.only.split(",")) if args.only else None
+    if args.duration is not None:
+        suite["load"] = merged(suite.get("load"), {"duration": args.duration})
+
+    rows = []
+    with open(args.log, "a") as log:
+        for config in suite["configs"]:
+            if wanted and config["name"] not in wanted:
+                continue
+            if args.duration is not None:
+                config = {**config, "load": merged(config.get("load"), {"duration": args.duration})}
+            print(f"Running {config['name']} ...", file=sys.stderr, flush=True)
+            try:
+                rows.append(run_config(config, suite, log))
+            except Exception as e:
+                rows.append({"name": config["name"], "failed": str(e)})
+    print(report(rows))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
@@ -0,0 +1,152 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# -----------------------------
+# Bounded key-value caches with TTL and hit/miss counters
+# -----------------------------
+def normalize_question(text):
+    """Cache key form of a user question: case-folded, whitespace collapsed, trailing punctuation dropped."""
+    return " ".join(text.casefold().split()).strip(" ?!.")
+
+
+class MemoryCache:
+    """In-process LRU cache with per-entry TTL. Thread-safe."""
+
+    def __init__(self, max_entries=1024, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[1] < time.time():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.time() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": "memory",
+            "entries": len(self),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class SqliteCache(MemoryCache):
+    """Host-wide cache in a local SQLite file, shared by every gunicorn worker.
+
+    Values must be JSON-serializable. Entries are evicted least-recently-used
+    once the table exceeds ``max_entries``; counters are per process.
+    """
+
+    def __init__(self, path, max_entries=1024, ttl=3600):
+        super().__init__(max_entries, ttl)
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL, used REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_used ON cache(used)")
+        conn.commit()
+
+    def _conn(self):
+        # sqlite3 connections cannot be shared across threads; keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._conn()
+        now = time.time()
+        row = conn.execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < now:
+            with self._lock:
+                self.misses += 1
+            return None
+        conn.execute("UPDATE cache SET used = ? WHERE key = ?", (now, key))
+        conn.commit()
+        with self._lock:
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        conn = self._conn()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires, used) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value), now + self.ttl, now),
+        )
+        conn.execute("DELETE FROM cache WHERE expires < ?", (now,))
+        excess = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.max_entries
+        if excess > 0:
+            conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY used LIMIT ?)", (excess,)
+            )
+            with self._lock:
+                self.evictions += excess
+        conn.commit()
+
+    def clear(self):
+        conn = self._conn()
+        conn.execute("DELETE FROM cache")
+        conn.commit()
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def stats(self):
+        stats = super().stats()
+        stats.update(backend="sqlite", path=self.path)
+        return stats
+
+
+def make_cache(backend, path=None, max_entries=1024, ttl=3600):
+    """Build a cache from config: backend is "memory", "sqlite" or "off" (returns None)."""
+    backend = (backend or "off").lower()
+    if backend == "memory":
+        return MemoryCache(max_entries, ttl)
+    if backend == "sqlite":
+        return SqliteCache(path, max_entries, ttl)
+    if backend in ("off", "none", "0", "false"):
+        return None
+    raise ValueError(f"Unknown cache backend {backend!r}; use memory, sqlite or off.")
@@ -0,0 +1,104 @@
+import numpy as np
+
+# -----------------------------
+# Chunk metadata store: NumPy columns and interned strings, O(1) row access
+# -----------------------------
+# Values create_embedding.py (and older exports) store when a subtitle file has no title or number
+UNKNOWN_VALUES = frozenset({"", "N/A", "Unknown", "nan", "None"})
+
+
+def is_known(value):
+    return str(value).strip() not in UNKNOWN_VALUES
+
+
+def video_key(title, number):
+    """(title, number) naming one video, or None when either is a placeholder and the video is unknown."""
+    if is_known(title) and is_known(number):
+        return str(title).strip(), str(number).strip()
+    return None
+
+
+def intern_strings(values):
+    """(table, ids): distinct strings in first-seen order and an int32 id per value."""
+    table, ids, lookup = [], np.empty(len(values), dtype=np.int32), {}
+    for i, value in enumerate(values):
+        value = str(value)
+        if value not in lookup:
+            lookup[value] = len(table)
+            table.append(value)
+        ids[i] = lookup[value]
+    return table, ids
+
+
+class ChunkStore:
+    """Subtitle chunk metadata without pandas.
+
+    Titles and numbers are int32 ids into small string tables, start/end are
+    float32 arrays, and texts live in one UTF-8 byte buffer with an offsets
+    array. The buffer may be a read-only memmap of the index's text.bin, shared
+    by all workers. A row is decoded only when it is asked for.
+    """
+
+    def __init__(self, title_table, title_ids, number_table, number_ids, starts, ends, text_blob, text_offsets):
+        self.title_table = list(title_table)
+        self.title_ids = np.asarray(title_ids, dtype=np.int32)
+        self.number_table = list(number_table)
+        self.number_ids = np.asarray(number_ids, dtype=np.int32)
+        self.starts = np.asarray(starts, dtype=np.float32)
+        self.ends = np.asarray(ends, dtype=np.float32)
+        self.text_blob = text_blob
+        self.text_offsets = np.asarray(text_offsets, dtype=np.int64)
+        rows = len(self.text_offsets) - 1
+        for name in ("title_ids", "number_ids", "starts", "ends"):
+            if len(getattr(self, name)) != rows:
+                raise ValueError(f"Chunk column {name} has {len(getattr(self, name))} rows, expected {rows}.")
+
+    @classmethod
+    def from_columns(cls, titles, numbers, starts, ends, texts):
+        title_table, title_ids = intern_strings(titles)
+        number_table, number_ids = intern_strings(numbers)
+        encoded = [str(t).encode("utf-8") for t in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(title_table, title_ids, number_table, number_ids, starts, ends, blob, offsets)
+
+    def __len__(self):
+        return len(self.text_offsets) - 1
+
+    def title(self, i):
+        return self.title_table[self.title_ids[i]]
+
+    def number(self, i):
+        return self.number_table[self.number_ids[i]]
+
+    def text(self, i):
+        return self.text_blob[self.text_offsets[i]:self.text_offsets[i + 1]].tobytes().decode("utf-8")
+
+    def record(self, i):
+        return {
+            "id": int(i),
+            "title": self.title(i),
+            "number": self.number(i),
+            "start": round(float(self.starts[i]), 2),
+            "end": round(float(self.ends[i]), 2),
+            "text": self.text(i),
+        }
+
+    # Whole columns, for writing an index or building one-off lookups (not for the request path)
+    @property
+    def titles(self):
+        return np.asarray(self.title_table, dtype=object)[self.title_ids]
+
+    @property
+    def numbers(self):
+        return np.asarray(self.number_table, dtype=object)[self.number_ids]
+
+    @property
+    def texts(self):
+        return [self.text(i) for i in range(len(self))]
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.title_ids, self.number_ids, self.starts, self.ends, self.text_offsets)) \
+            + self.text_blob.nbytes
@@ -0,0 +1,176 @@
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Shared, pooled HTTP client for the Cohere API
+# -----------------------------
+DEFAULT_CHAT_URL = "https://api.cohere.com/v2/chat"
+DEFAULT_EMBED_URL = "https://api.cohere.ai/v1/embed"
+
+
+def endpoint_urls():
+    """(chat URL, embed URL), overridable so load tests can point at a local stand-in (bench/mock_cohere.py).
+
+    Read when called, not at import, so COHERE_CHAT_URL / COHERE_EMBED_URL set in .env apply after load_dotenv().
+    """
+    return os.getenv("COHERE_CHAT_URL", DEFAULT_CHAT_URL), os.getenv("COHERE_EMBED_URL", DEFAULT_EMBED_URL)
+
+
+class CohereClient:
+    """Keep-alive connection pool for Cohere calls, one per process.
+
+    Uses a ``requests.Session`` with a sized ``HTTPAdapter`` so repeated calls
+    reuse TCP+TLS connections. With ``http2=True`` and ``httpx[http2]``
+    installed, an ``httpx.Client`` is used instead. The underlying client is
+    recreated after a fork, so gunicorn workers never share sockets.
+    """
+
+    def __init__(self, api_key, pool_size=10, connect_timeout=5, read_timeout=30, http2=False):
+        self.api_key = api_key
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.http2 = http2
+        self._client = None
+        self._is_httpx = False
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def headers(self):
+        return {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+
+    def _build(self):
+        if self.http2:
+            try:
+                import httpx
+
+                client = httpx.Client(
+                    http2=True,
+                    headers=self.headers,
+                    timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+                    limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                )
+                self._is_httpx = True
+                return client
+            except ImportError:
+                logger.warning("COHERE_HTTP2 requested but httpx[http2] is not installed; using requests.")
+        # Imported on first use (or by the startup warm-up) so importing this module stays cheap
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self._is_httpx = False
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size, max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update(self.headers)
+        return session
+
+    @property
+    def client(self):
+        if self._client is None or self._pid != os.getpid():
+            with self._lock:
+                if self._client is None or self._pid != os.getpid():
+                    self._client = self._build()
+                    self._pid = os.getpid()
+        return self._client
+
+    def post(self, url, payload, timeout=None):
+        """POST JSON and return the response (``status_code``, ``json()``, ``raise_for_status()``)."""
+        client = self.client
+        if not self._is_httpx:
+            return client.post(url, json=payload, timeout=timeout or self.timeout)
+        # httpx: (connect, read) tuple -> Timeout object; default comes from the client
+        if timeout is None:
+            return client.post(url, json=payload)
+        import httpx
+
+        return client.post(url, json=payload, timeout=httpx.Timeout(timeout[1], connect=timeout[0]))
+
+    def stream(self, url, payload, timeout=None):
+        """POST with ``stream: true`` and yield each server-sent event's ``data`` parsed as JSON.
+
+        Raises the HTTP library's status error (with ``.response``) on non-2xx.
+        """
+        client = self.client
+        if not self._is_httpx:
+            with client.post(url, json=payload, timeout=timeout or self.timeout, stream=True) as r:
+                r.raise_for_status()
+                yield from _sse_data(r.iter_lines(decode_unicode=True))
+            return
+        with client.stream("POST", url, json=payload) as r:
+            r.raise_for_status()
+            yield from _sse_data(r.iter_lines())
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+
+class AsyncCohereClient:
+    """httpx.AsyncClient counterpart of CohereClient for the ASGI app (asgi.py).
+
+    Created lazily inside the running event loop; one pool per worker process.
+    """
+
+    def __init__(self, api_key, pool_size=100, connect_timeout=5, read_timeout=30, http2=False):
+        self.api_key = api_key
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.http2 = http2
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import httpx
+
+            self._client = httpx.AsyncClient(
+                http2=self.http2,
+                headers={"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"},
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+            )
+        return self._client
+
+    async def post(self, url, payload):
+        return await self.client.post(url, json=payload)
+
+    async def stream(self, url, payload):
+        """Async version of CohereClient.stream()."""
+        async with self.client.stream("POST", url, json=payload) as r:
+            r.raise_for_status()
+            async for line in r.aiter_lines():
+                for event in _sse_data([line]):
+                    yield event
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def _sse_data(lines):
+    for line in lines:
+        if line and line.startswith("data:"):
+            data = line[5:].strip()
+            if data and data != "[DONE]":
+                yield json.loads(data)
+
+
+def from_env(api_key, asynchronous=False, **overrides):
+    """Client configured from COHERE_POOL_SIZE / COHERE_CONNECT_TIMEOUT / COHERE_READ_TIMEOUT / COHERE_HTTP2."""
+    settings = {
+        "pool_size": int(os.getenv("COHERE_POOL_SIZE", "100" if asynchronous else "10")),
+        "connect_timeout": float(os.getenv("COHERE_CONNECT_TIMEOUT", "5")),
+        "read_timeout": float(os.getenv("COHERE_READ_TIMEOUT", "30")),
+        "http2": os.getenv("COHERE_HTTP2", "false").lower() in ("1", "true", "yes"),
+    }
+    settings.update(overrides)
+    return (AsyncCohereClient if asynchronous else CohereClient)(api_key, **settings)
@@ -0,0 +1,169 @@
+import re
+
+from chunk_store import video_key
+
+# -----------------------------
+# Context packing: fit the retrieved chunks into a token budget for the chat prompt
+# -----------------------------
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+# Prompt tokens a chunk costs besides its text: its "[m:ss-m:ss]" label plus a share of a video header
+CHUNK_OVERHEAD_TOKENS = 12
+
+
+def count_tokens(text):
+    """Approximate tokenizer count: one per word or punctuation mark, plus one per 8 characters of long words.
+
+    Cohere's tokenizer is not available offline; this tracks it closely
+    enough for budgeting English subtitles without shipping a vocabulary.
+    """
+    return sum(1 + len(tok) // 8 for tok in _TOKEN_RE.findall(text))
+
+
+def split_sentences(text):
+    return [s for s in _SENTENCE_RE.split(text.strip()) if s]
+
+
+def trim_to_tokens(text, max_tokens):
+    """Longest prefix of whole sentences within max_tokens.
+
+    If even the first sentence is too long, it is cut at a word boundary and
+    marked with an ellipsis. Returns "" when nothing fits.
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+    kept, used = [], 0
+    for sentence in split_sentences(text):
+        cost = count_tokens(sentence)
+        if used + cost > max_tokens:
+            break
+        kept.append(sentence)
+        used += cost
+    if kept:
+        return " ".join(kept)
+    words, used = [], 0
+    for word in text.split():
+        cost = count_tokens(word)
+        if used + cost > max_tokens - 1:
+            break
+        words.append(word)
+        used += cost
+    return " ".join(words) + "…" if words else ""
+
+
+def _sentence_key(sentence):
+    return " ".join(sentence.casefold().split())
+
+
+def merge_adjacent(chunks, scores, gap=2.0):
+    """Coalesce retrieved chunks that overlap or touch in time within the same video.
+
+    Chunks with the same known title and number whose spans are at most ``gap``
+    seconds apart become one chunk covering the whole start-end range, with
+    their text joined in time order. Sentences already seen in the same video
+    (overlapping subtitle windows repeat them) are dropped. A merged chunk keeps
+    its best member's score, and ``end_id`` names the row its span ends with.
+    ``member_ends`` lists (tokens of text so far, end, end_id) after each
+    member, so pack_context() can pull the end back when it trims the text.
+    Chunks whose title or number is a placeholder ("Unknown", "N/A", ...) may
+    come from any lecture, so they are never merged with anything.
+    Returns (chunks, scores), best first.
+    """
+    videos = {}
+    for i, (chunk, score) in enumerate(zip(chunks, scores)):
+        key = video_key(chunk["title"], chunk["number"]) or ("unknown", i)
+        videos.setdefault(key, []).append((chunk, score))
+    spans = []
+    for video, members in videos.items():
+        members.sort(key=lambda pair: pair[0]["start"])
+        group = [members[0]]
+        for chunk, score in members[1:]:
+            if chunk["start"] <= max(c["end"] for c, _ in group) + gap:
+                group.append((chunk, score))
+            else:
+                spans.append((video, group))
+                group = [(chunk, score)]
+        spans.append((video, group))
+    spans.sort(key=lambda span: -max(score for _, score in span[1]))
+
+    seen = {}
+    merged, merged_scores = [], []
+    for video, group in spans:
+        sentences, member_ends, tokens, last = [], [], 0, None
+        video_seen = seen.setdefault(video, set())
+        for chunk, _ in group:
+            for sentence in split_sentences(chunk["text"]):
+                key = _sentence_key(sentence)
+                if key not in video_seen:
+                    video_seen.add(key)
+                    sentences.append(sentence)
+                    tokens += count_tokens(sentence)
+            if last is None or chunk["end"] > last["end"]:
+                last = chunk
+            member_ends.append((tokens, last["end"], last.get("id")))
+        if not sentences:
+            continue
+        first = group[0][0]
+        merged.append({
+            **first,
+            "start": first["start"],
+            "end": last["end"],
+            "text": " ".join(sentences),
+        })
+        if "id" in last:
+            merged[-1]["end_id"] = last["id"]
+        if len(group) > 1:
+            merged[-1]["member_ends"] = member_ends
+        merged_scores.append(max(score for _, score in group))
+    return merged, merged_scores
+
+
+def _trimmed(chunk, text):
+    """Copy of ``chunk`` with ``text``; a trimmed merged span ends with the last member whose text survived."""
+    packed = {key: value for key, value in chunk.items() if key != "member_ends"}
+    packed["text"] = text
+    if text != chunk["text"] and chunk.get("member_ends"):
+        kept = count_tokens(text.removesuffix("…"))
+        for tokens, end, end_id in chunk["member_ends"]:
+            if tokens >= kept:
+                packed["end"] = end
+                if end_id is not None:
+                    packed["end_id"] = end_id
+                break
+    return packed
+
+
+def pack_context(chunks, scores, budget=1500, chunk_tokens=300, score_margin=None, min_tokens=40):
+    """Select and trim retrieved chunks (best first) so their prompt cost fits ``budget`` tokens.
+
+    Chunks scoring more than ``score_margin`` below the best one are dropped as
+    low-relevance tail. Each chunk's text is capped at ``chunk_tokens`` and
+    trimmed on sentence boundaries. Chunks are then added greedily in score
+    order; the first one that does not fit is trimmed into the remaining
+    budget when at least ``min_tokens`` of text fit, and packing stops there.
+    The best chunk is always kept, trimmed if necessary. A trimmed merged
+    chunk's ``end``/``end_id`` move back to the text that is left, so its
+    label never covers unseen text. Returns the packed chunk dicts (copies)
+    in score order.
+    """
+    if not chunks:
+        return []
+    best = max(scores)
+    packed, remaining = [], budget
+    for chunk, score in sorted(zip(chunks, scores), key=lambda pair: -pair[1]):
+        if score_margin is not None and score < best - score_margin:
+            break
+        text = trim_to_tokens(chunk["text"], chunk_tokens) if chunk_tokens else chunk["text"]
+        cost = count_tokens(text) + CHUNK_OVERHEAD_TOKENS
+        if cost > remaining:
+            room = remaining - CHUNK_OVERHEAD_TOKENS
+            if not packed:
+                room = max(room, min_tokens)  # always keep some of the best chunk
+            text = trim_to_tokens(text, room) if room >= min_tokens else ""
+            if text:
+                packed.append(_trimmed(chunk, text))
+            break
+        packed.append(_trimmed(chunk, text))
+        remaining -= cost
+    return packed
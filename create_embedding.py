@@ -4,22 +4,29 @@ import pandas as pd
 import requests
 import joblib
 from config import api_key  
+import cohere_client
+import ratelimit
+from ann import IVFIndex
+import index_store
 
-COHERE_EMBED_URL = "https://api.cohere.ai/v1/embed"
+# Same pooled keep-alive client as the web app; bulk batches get a longer read timeout
+cohere = cohere_client.from_env(api_key, read_timeout=120)
+_, COHERE_EMBED_URL = cohere_client.endpoint_urls()
+# Same COHERE_EMBED_RPM quota as the web workers on this host; ingest waits as long as it takes
+limiter = ratelimit.from_env(max_wait=float("inf"))
 
 def create_embedding(text_list):
-    """Create embeddings using Cohere v3."""
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
+    """Create float, int8 and packed-binary embeddings using Cohere v3."""
     data = {
         "model": "embed-english-v3.0",  # or embed-multilingual-v3.0
         "texts": text_list,
-        "input_type": "search_document"  # required for v3.0 models
+        "input_type": "search_document",  # required for v3.0 models
+        "embedding_types": ["float", "int8", "ubinary"]
     }
+    if limiter is not None:
+        limiter.acquire({"embed": 1})
     try:
-        r = requests.post(COHERE_EMBED_URL, headers=headers, json=data)
+        r = cohere.post(COHERE_EMBED_URL, data)
         r.raise_for_status()
     except requests.exceptions.HTTPError as e:
         print("Error response from Cohere:")
@@ -27,7 +34,7 @@ def create_embedding(text_list):
         raise e
 
     resp_json = r.json()
-    return resp_json["embeddings"]
+    return resp_json["embeddings"]  # {"float": [...], "int8": [...], "ubinary": [...]}
 
 
 # -----------------------------
@@ -63,22 +70,34 @@ print(f"Loaded {len(df)} chunks from {len(json_files)} JSON files.")
 # -----------------------------
 print("Creating embeddings with Cohere (this may take a while)...")
 batch_size = 50
-embeddings = []
+embeddings = {"float": [], "int8": [], "ubinary": []}
 
 for i in range(0, len(df), batch_size):
     batch_texts = df["text"].iloc[i:i + batch_size].tolist()
     try:
         batch_emb = create_embedding(batch_texts)
-        embeddings.extend(batch_emb)
+        for kind in embeddings:
+            embeddings[kind].extend(batch_emb[kind])
     except Exception as e:
         print(f" Failed at batch {i}–{i+batch_size}: {e}")
         continue
     print(f"Processed {min(i + batch_size, len(df))} / {len(df)}")
 
-df["embedding"] = embeddings
+df["embedding"] = embeddings["float"]
+df["embedding_int8"] = embeddings["int8"]  # used when QUANTIZATION=int8
+df["embedding_ubinary"] = embeddings["ubinary"]  # used when QUANTIZATION=binary
 
 # -----------------------------
 # Save for later use in Flask app
 # -----------------------------
 joblib.dump(df, "embeddings.joblib")
 print(" All embeddings created and saved to embeddings.joblib")
+
+# -----------------------------
+# Write the memory-mapped index directory and the IVF approximate index (INDEX_ENGINE=ivf)
+# -----------------------------
+index = index_store.save_dataframe(df, "index")
+print(f" Index written to index/ (index_version {index.version})")
+ivf = IVFIndex.build(index.vectors, index_version=index.version)
+ivf.save("embeddings.ivf.npz")
+print(f" IVF index with {ivf.nlist} lists saved to embeddings.ivf.npz")
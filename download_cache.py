@@ -0,0 +1,120 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, each process downloads on its own
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Host-local cache for remote index files (EMBEDDINGS_URL)
+# -----------------------------
+# <cache_dir>/<key>.data       downloaded body
+# <cache_dir>/<key>.meta.json  url, etag, last_modified, sha256, bytes, checked_at
+# <cache_dir>/<key>.lock       flock() target so one process per host downloads
+CHUNK_SIZE = 1 << 20
+
+
+@contextmanager
+def file_lock(path):
+    """Exclusive advisory lock shared by all processes on this host."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a+") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _read_meta(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(path, meta):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp, path)
+
+
+def fetch(url, cache_dir, expected_sha256=None, max_age=300, timeout=60):
+    """Return a local path holding the body of ``url``, downloading only when it changed.
+
+    A cached copy younger than ``max_age`` seconds is used as-is; an older one
+    is revalidated with If-None-Match / If-Modified-Since. New bodies are
+    streamed to disk and their sha256 checked against ``expected_sha256`` (when
+    given) before replacing the cached file. If the server cannot be reached a
+    stale cached copy is still returned.
+    """
+    import requests  # only workers that download pay for importing it
+
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+    data_path = os.path.join(cache_dir, f"{key}.data")
+    meta_path = os.path.join(cache_dir, f"{key}.meta.json")
+
+    with file_lock(os.path.join(cache_dir, f"{key}.lock")):
+        meta = _read_meta(meta_path)
+        cached = meta is not None and os.path.isfile(data_path) and os.path.getsize(data_path) == meta.get("bytes")
+        if cached and expected_sha256 and meta.get("sha256") != expected_sha256:
+            cached = False
+        if cached and time.time() - meta.get("checked_at", 0) < max_age:
+            return data_path
+
+        headers = {}
+        if cached and meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if cached and meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        try:
+            r = requests.get(url, headers=headers, stream=True, timeout=timeout)
+            if r.status_code == 304 and cached:
+                r.close()
+                meta["checked_at"] = time.time()
+                _write_meta(meta_path, meta)
+                logger.info("Cached copy of %s is current (304).", url)
+                return data_path
+            r.raise_for_status()
+        except Exception:
+            if cached:
+                logger.warning("Could not revalidate %s; using cached copy.", url, exc_info=True)
+                return data_path
+            raise
+
+        tmp_path = f"{data_path}.{os.getpid()}.tmp"
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with r, open(tmp_path, "wb") as f:
+                for block in r.iter_content(CHUNK_SIZE):
+                    f.write(block)
+                    digest.update(block)
+                    size += len(block)
+            if expected_sha256 and digest.hexdigest() != expected_sha256:
+                raise ValueError(f"Download of {url} failed its sha256 check.")
+            os.replace(tmp_path, data_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        _write_meta(meta_path, {
+            "url": url,
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+            "sha256": digest.hexdigest(),
+            "bytes": size,
+            "checked_at": time.time(),
+        })
+        logger.info("Downloaded %s (%.1f MB) to %s.", url, size / 1e6, data_path)
+        return data_path
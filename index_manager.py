@@ -0,0 +1,124 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Hot-reloadable retrieval index
+# -----------------------------
+class IndexManager:
+    """Holds the active retrieval index and swaps in new builds without a restart.
+
+    ``loader()`` builds a fresh index (or returns None on failure) and
+    ``source_version()`` cheaply reports the version of whatever is published
+    (manifest index_version, file stamp, ...). A daemon thread polls the source
+    every ``interval`` seconds and, when the version changes, builds the new
+    index in the background before replacing the reference in one assignment.
+    Requests read ``manager.current`` once and keep using that snapshot, so
+    in-flight requests finish on the index they started with.
+
+    ``start(load=True)`` also performs the first load on that thread, so a
+    worker can answer health checks while the index is still being read;
+    ``ready`` turns True once an index is active.
+    """
+
+    def __init__(self, loader, source_version, interval=60):
+        self.loader = loader
+        self.source_version = source_version
+        self.interval = interval
+        self.current = None
+        self.version = None
+        self.loaded_at = None
+        self.last_error = None
+        self.reloads = 0
+        self.loading = False
+        self._reload_lock = threading.Lock()
+        self._thread = None
+        self._listeners = []
+
+    def on_swap(self, callback):
+        """Register callback(new_index, old_index) to run after each swap (e.g. cache invalidation)."""
+        self._listeners.append(callback)
+
+    def _safe_source_version(self):
+        try:
+            return self.source_version()
+        except Exception as e:
+            logger.exception("Could not read index source version")
+            self.last_error = f"source version: {e}"
+            return None
+
+    def reload(self, force=False):
+        """Build and swap in a new index if the source changed (or always, when force=True). Returns True on swap."""
+        with self._reload_lock:
+            version = self._safe_source_version()
+            if not force and self.current is not None and (version is None or version == self.version):
+                return False
+            started = time.perf_counter()
+            try:
+                index = self.loader()
+            except Exception as e:
+                logger.exception("Index reload failed; keeping version %s", self.version)
+                self.last_error = str(e)
+                return False
+            if index is None:
+                self.last_error = "loader returned no index"
+                logger.warning("Index reload produced no index; keeping version %s", self.version)
+                return False
+            old = self.current
+            self.current = index
+            self.version = index.version or version
+            self.loaded_at = time.time()
+            self.last_error = None
+            self.reloads += 1
+            logger.info("Activated index version %s (%d chunks) in %.2fs.",
+                        self.version, len(index), time.perf_counter() - started)
+        for callback in self._listeners:
+            try:
+                callback(index, old)
+            except Exception:
+                logger.exception("Index swap listener failed")
+        return True
+
+    @property
+    def ready(self):
+        return self.current is not None
+
+    def start(self, load=False):
+        """Start the background thread: the first load when load=True, then the watcher (when interval > 0).
+
+        No-op when there is nothing to do or the thread is already running.
+        """
+        if (self.interval <= 0 and not load) or (self._thread is not None and self._thread.is_alive()):
+            return
+        self.loading = load
+        self._thread = threading.Thread(target=self._watch, args=(load,), name="index-watcher", daemon=True)
+        self._thread.start()
+
+    def _watch(self, load=False):
+        if load:
+            try:
+                self.reload()
+            finally:
+                self.loading = False
+        if self.interval <= 0:
+            return
+        while True:
+            time.sleep(self.interval)
+            self.reload()
+
+    def status(self):
+        index = self.current
+        return {
+            "loaded": index is not None,
+            "loading": self.loading,
+            "version": self.version,
+            "loaded_at": self.loaded_at,
+            "chunks": len(index) if index is not None else 0,
+            "dim": index.dim if index is not None else None,
+            "engine": index.engine if index is not None else None,
+            "reloads": self.reloads,
+            "watch_interval": self.interval,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,293 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import zipfile
+
+import numpy as np
+
+from chunk_store import ChunkStore, intern_strings
+from retrieval import RetrievalIndex
+from quantize import BinaryEngine, Int8Engine, quantize_binary, quantize_int8
+
+# -----------------------------
+# Versioned on-disk index format (no pickle; vectors opened with np.memmap)
+# -----------------------------
+# <dir>/manifest.json    format version, model, dim, rows, per-file sha256 and size
+# <dir>/vectors.npy      float32 (rows x dim), already L2-normalized
+# <dir>/int8.npy         int8 codes (rows x dim)
+# <dir>/ubinary.npy      packed sign bits (rows x dim/8)
+# <dir>/start.npy        float32 start seconds
+# <dir>/end.npy          float32 end seconds
+# <dir>/title_ids.npy    int32 ids into strings.json["title"]
+# <dir>/number_ids.npy   int32 ids into strings.json["number"]
+# <dir>/strings.json     interned string tables for low-cardinality columns
+# <dir>/text.bin         UTF-8 chunk texts, concatenated
+# <dir>/text_offsets.npy int64 (rows + 1) byte offsets into text.bin
+#
+# Workers map the .npy files read-only, so the OS page cache holds the single
+# shared copy of the vectors no matter how many gunicorn workers are running.
+FORMAT_NAME = "ragbased-index"
+FORMAT_VERSION = 2
+MANIFEST_FILE = "manifest.json"
+STRINGS_FILE = "strings.json"
+
+VECTOR_FILES = {"float": "vectors.npy", "int8": "int8.npy", "ubinary": "ubinary.npy"}
+COLUMN_FILES = {
+    "title": ("title_ids.npy", STRINGS_FILE),
+    "number": ("number_ids.npy", STRINGS_FILE),
+    "start": ("start.npy",),
+    "end": ("end.npy",),
+    "text": ("text.bin", "text_offsets.npy"),
+}
+COLUMN_FILES.update({name: (filename,) for name, filename in VECTOR_FILES.items()})
+ALL_FILES = sorted({f for files in COLUMN_FILES.values() for f in files})
+
+
+def exists(directory):
+    return os.path.isfile(os.path.join(directory, MANIFEST_FILE))
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST_FILE), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != FORMAT_NAME:
+        raise ValueError(f"{directory} is not a {FORMAT_NAME} directory.")
+    if manifest.get("version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported index format version {manifest.get('version')} (expected {FORMAT_VERSION}).")
+    return manifest
+
+
+def current_version(directory):
+    """index_version of a readable index directory, else None."""
+    try:
+        return read_manifest(directory)["index_version"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def verify(directory, checksums=True):
+    """Check file sizes (and sha256 when checksums=True) against the manifest. Returns the manifest."""
+    manifest = read_manifest(directory)
+    for name, info in manifest["files"].items():
+        path = os.path.join(directory, name)
+        if not os.path.isfile(path):
+            raise ValueError(f"Index file {name} is missing.")
+        if os.path.getsize(path) != info["bytes"]:
+            raise ValueError(f"Index file {name} has {os.path.getsize(path)} bytes, manifest says {info['bytes']}.")
+        if checksums and _sha256(path) != info["sha256"]:
+            raise ValueError(f"Index file {name} failed its sha256 check.")
+    return manifest
+
+
+def write(directory, vectors, titles, numbers, starts, ends, texts,
+          int8_codes=None, binary_codes=None, model="embed-english-v3.0"):
+    """Write a complete index directory atomically (built beside it, then renamed into place)."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    rows, dim = vectors.shape
+    tmp = directory.rstrip("/\\") + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    np.save(os.path.join(tmp, VECTOR_FILES["float"]), vectors)
+    np.save(os.path.join(tmp, VECTOR_FILES["int8"]),
+            quantize_int8(vectors) if int8_codes is None else np.asarray(int8_codes, dtype=np.int8))
+    np.save(os.path.join(tmp, VECTOR_FILES["ubinary"]),
+            quantize_binary(vectors) if binary_codes is None else np.asarray(binary_codes, dtype=np.uint8))
+    np.save(os.path.join(tmp, "start.npy"), np.asarray(starts, dtype=np.float32))
+    np.save(os.path.join(tmp, "end.npy"), np.asarray(ends, dtype=np.float32))
+
+    title_table, title_ids = intern_strings(titles)
+    number_table, number_ids = intern_strings(numbers)
+    np.save(os.path.join(tmp, "title_ids.npy"), title_ids)
+    np.save(os.path.join(tmp, "number_ids.npy"), number_ids)
+    with open(os.path.join(tmp, STRINGS_FILE), "w", encoding="utf-8") as f:
+        json.dump({"title": title_table, "number": number_table}, f, ensure_ascii=False)
+
+    encoded = [str(t).encode("utf-8") for t in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    with open(os.path.join(tmp, "text.bin"), "wb") as f:
+        f.write(b"".join(encoded))
+    np.save(os.path.join(tmp, "text_offsets.npy"), offsets)
+
+    files = {name: {"sha256": _sha256(os.path.join(tmp, name)), "bytes": os.path.getsize(os.path.join(tmp, name))}
+             for name in ALL_FILES}
+    manifest = {
+        "format": FORMAT_NAME,
+        "version": FORMAT_VERSION,
+        "model": model,
+        "dim": int(dim),
+        "rows": int(rows),
+        "files": files,
+        # Content id of this build; changes whenever any file changes
+        "index_version": hashlib.sha256(
+            "".join(files[name]["sha256"] for name in ALL_FILES).encode()
+        ).hexdigest()[:16],
+    }
+    with open(os.path.join(tmp, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    old = directory.rstrip("/\\") + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(directory):
+        os.rename(directory, old)
+    os.rename(tmp, directory)
+    shutil.rmtree(old, ignore_errors=True)
+    return manifest
+
+
+def read_vectors(directory, kinds, mmap=True, manifest=None):
+    """Load only the requested vector blocks ("float", "int8", "ubinary"), memory-mapped when mmap=True."""
+    manifest = manifest or read_manifest(directory)
+    out = {}
+    for kind in kinds:
+        if kind not in VECTOR_FILES:
+            raise ValueError(f"Unknown vector kind {kind!r}; use {', '.join(VECTOR_FILES)}.")
+        out[kind] = np.load(os.path.join(directory, VECTOR_FILES[kind]), mmap_mode="r" if mmap else None,
+                            allow_pickle=False)
+        if len(out[kind]) != manifest["rows"]:
+            raise ValueError(f"{kind} vectors have {len(out[kind])} rows, manifest says {manifest['rows']}.")
+    return out
+
+
+def read_chunks(directory, manifest=None):
+    """ChunkStore straight from the interned columns; text.bin is memory-mapped, not decoded."""
+    manifest = manifest or read_manifest(directory)
+    path = lambda name: os.path.join(directory, name)
+    with open(path(STRINGS_FILE), "r", encoding="utf-8") as f:
+        strings = json.load(f)
+    offsets = np.load(path("text_offsets.npy"), allow_pickle=False)
+    # np.memmap cannot map an empty file
+    blob = np.memmap(path("text.bin"), dtype=np.uint8, mode="r") if offsets[-1] else np.zeros(0, dtype=np.uint8)
+    chunks = ChunkStore(
+        strings["title"], np.load(path("title_ids.npy"), allow_pickle=False),
+        strings["number"], np.load(path("number_ids.npy"), allow_pickle=False),
+        np.load(path("start.npy"), allow_pickle=False), np.load(path("end.npy"), allow_pickle=False),
+        blob, offsets,
+    )
+    if len(chunks) != manifest["rows"]:
+        raise ValueError(f"Index has {len(chunks)} chunks, manifest says {manifest['rows']}.")
+    return chunks
+
+
+def load(directory, quantization="none", keep_float=True, rescore_factor=4):
+    """Open an index directory, reading only the vector blocks the chosen search mode needs."""
+    manifest = verify(directory, checksums=False)
+    if quantization not in ("none", "", None, "int8", "binary"):
+        raise ValueError(f"Unknown quantization {quantization!r}; use none, int8 or binary.")
+    quantized = quantization in ("int8", "binary")
+    kinds = []
+    if keep_float or not quantized:
+        kinds.append("float")
+    if quantization == "int8":
+        kinds.append("int8")
+    elif quantization == "binary":
+        kinds.append("ubinary")
+    data = read_vectors(directory, kinds, manifest=manifest)
+    index = RetrievalIndex(data.get("float"), read_chunks(directory, manifest), normalized=True, dim=manifest["dim"])
+    index.manifest = manifest
+    if quantization == "int8":
+        index.attach_quantized(Int8Engine(data["int8"]), keep_float, rescore_factor)
+    elif quantization == "binary":
+        index.attach_quantized(BinaryEngine(data["ubinary"], manifest["dim"]), keep_float, rescore_factor)
+    return index
+
+
+def save(index, directory, int8_codes=None, binary_codes=None, model="embed-english-v3.0"):
+    if index.vectors is None:
+        raise ValueError("Saving needs the float vectors; build the index with keep_float=True.")
+    chunks = index.chunks
+    return write(directory, index.vectors, chunks.titles, chunks.numbers, chunks.starts, chunks.ends, chunks.texts,
+                 int8_codes, binary_codes, model)
+
+
+def save_dataframe(df, directory, model="embed-english-v3.0"):
+    """Convert a DataFrame as written by create_embedding.py into an index directory."""
+    index = RetrievalIndex.from_dataframe(df)
+    int8_codes = df["embedding_int8"].tolist() if "embedding_int8" in df.columns else None
+    binary_codes = df["embedding_ubinary"].tolist() if "embedding_ubinary" in df.columns else None
+    index.manifest = save(index, directory, int8_codes, binary_codes, model)
+    return index
+
+
+def pack(directory, path):
+    """Bundle an index directory into a single uncompressed zip (for EMBEDDINGS_URL hosting)."""
+    manifest = verify(directory)
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED) as zf:
+        zf.write(os.path.join(directory, MANIFEST_FILE), MANIFEST_FILE)
+        for name in manifest["files"]:
+            zf.write(os.path.join(directory, name), name)
+    return manifest
+
+
+def bundle_manifest(source):
+    """Manifest stored inside a bundle, read without extracting anything else."""
+    with zipfile.ZipFile(source) as zf:
+        return json.loads(zf.read(MANIFEST_FILE).decode("utf-8"))
+
+
+def unpack(source, directory):
+    """Extract a bundle written by pack() and verify every checksum before it is used."""
+    tmp = directory.rstrip("/\\") + f".unpack-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    with zipfile.ZipFile(source) as zf:
+        for name in zf.namelist():
+            # Only known flat file names; never trust paths from a downloaded archive
+            if name != MANIFEST_FILE and name not in ALL_FILES:
+                raise ValueError(f"Unexpected file {name!r} in index bundle.")
+            with zf.open(name) as src, open(os.path.join(tmp, name), "wb") as dst:
+                shutil.copyfileobj(src, dst, 1 << 20)
+    try:
+        manifest = verify(tmp)
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    old = directory.rstrip("/\\") + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(directory):
+        os.rename(directory, old)
+    os.rename(tmp, directory)
+    shutil.rmtree(old, ignore_errors=True)
+    return manifest
+
+
+# -----------------------------
+# CLI: python index_store.py {convert,verify,pack}
+# -----------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Build, check or bundle the on-disk retrieval index.")
+    parser.add_argument("command", nargs="?", default="convert", choices=["convert", "verify", "pack"])
+    parser.add_argument("--embeddings", default="embeddings.joblib", help="joblib DataFrame to convert")
+    parser.add_argument("--dir", default="index", help="index directory")
+    parser.add_argument("--bundle", default="index.zip", help="output of the pack command")
+    parser.add_argument("--model", default="embed-english-v3.0")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        import joblib
+
+        index = save_dataframe(joblib.load(args.embeddings), args.dir, model=args.model)
+        print(f"Wrote {len(index)} chunks x {index.dim} dims to {args.dir}/ "
+              f"(index_version {index.manifest['index_version']})")
+    elif args.command == "verify":
+        manifest = verify(args.dir)
+        print(f"OK: {manifest['rows']} rows x {manifest['dim']} dims, model {manifest['model']}, "
+              f"index_version {manifest['index_version']}")
+    else:
+        manifest = pack(args.dir, args.bundle)
+        print(f"Packed index_version {manifest['index_version']} into {args.bundle}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,21 @@
 import os
-from io import BytesIO
+import startup
+startup.install_import_profile()  # IMPORT_PROFILE=1: log how long each import takes (see startup.py)
+import json
 import logging
-import pandas as pd
-import numpy as np
-import joblib
-import requests
-from flask import Flask, render_template, request
-from sklearn.metrics.pairwise import cosine_similarity
+from flask import Flask, Response, render_template, request
 from dotenv import load_dotenv
+import download_cache
+import cohere_client
+from index_manager import IndexManager
+from cache import make_cache, normalize_question
+from context import merge_adjacent, pack_context
+from resilience import CircuitOpenError, Upstream
+import ratelimit
+from ratelimit import RateLimited, estimate_tokens
+from singleflight import make_single_flight
+from batching import MicroBatcher
+import metrics
 
 # Load environment variables
 load_dotenv()
@@ -17,6 +25,97 @@ if not COHERE_API_KEY:
 
 EMBEDDINGS_URL = os.getenv("EMBEDDINGS_URL")
 
+# Retrieval settings (overridable per request with topK / minScore form fields)
+TOP_K = int(os.getenv("TOP_K", "5"))
+MAX_TOP_K = int(os.getenv("MAX_TOP_K", "50"))
+MIN_SIMILARITY = float(os.getenv("MIN_SIMILARITY", "0")) if os.getenv("MIN_SIMILARITY") else None
+
+# Retrieval engine: "exact" brute-force cosine, or "ivf" (built offline by create_embedding.py / ann.py)
+INDEX_ENGINE = os.getenv("INDEX_ENGINE", "exact").lower()
+IVF_PATH = os.getenv("IVF_PATH", "embeddings.ivf.npz")
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+
+# Quantized first pass: "none", "int8" or "binary"; the shortlist (k * RESCORE_FACTOR rows) is rescored in float
+QUANTIZATION = os.getenv("QUANTIZATION", "none").lower()
+RESCORE_FACTOR = int(os.getenv("RESCORE_FACTOR", "4"))
+# int8 is a memory mode, so it drops the float matrix by default; binary keeps it for an accurate rescore
+KEEP_FLOAT_VECTORS = os.getenv(
+    "KEEP_FLOAT_VECTORS", "false" if QUANTIZATION == "int8" else "true"
+).lower() in ("1", "true", "yes")
+
+# Versioned index directory written by create_embedding.py / index_store.py (used when present).
+# EMBEDDINGS_URL may point to a bundle from "index_store.py pack" (.zip) or a legacy embeddings.joblib.
+INDEX_DIR = os.getenv("INDEX_DIR", "index")
+
+# Startup: "background" loads the index on a thread so /health answers at once and /ready reports when
+# questions can be served; "eager" loads it during import (use with gunicorn --preload, whose threads
+# do not survive the fork into workers).
+INDEX_LOAD = os.getenv("INDEX_LOAD", "background").lower()
+
+# Hot reload: poll the index source every INDEX_RELOAD_INTERVAL seconds (0 disables the watcher)
+INDEX_RELOAD_INTERVAL = int(os.getenv("INDEX_RELOAD_INTERVAL", "60"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Query-embedding cache: "memory" (per worker), "sqlite" (shared by all workers on the host) or "off"
+EMBED_CACHE = os.getenv("EMBED_CACHE", "memory")
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", ".cache/query_embeddings.sqlite")
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "2048"))
+EMBED_CACHE_TTL = int(os.getenv("EMBED_CACHE_TTL", "86400"))
+
+# Prompt context: retrieved chunks are packed greedily by score into CONTEXT_TOKEN_BUDGET tokens, each
+# capped at CONTEXT_CHUNK_TOKENS and trimmed at sentence boundaries. Chunks scoring more than
+# CONTEXT_SCORE_MARGIN below the best hit are dropped (1 keeps all of the top-k).
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+CONTEXT_CHUNK_TOKENS = int(os.getenv("CONTEXT_CHUNK_TOKENS", "300"))
+CONTEXT_SCORE_MARGIN = float(os.getenv("CONTEXT_SCORE_MARGIN", "0.15"))
+# Hits from the same video less than CONTEXT_MERGE_GAP seconds apart are merged into one time span
+CONTEXT_MERGE_GAP = float(os.getenv("CONTEXT_MERGE_GAP", "2"))
+
+# Micro-batching: query embeddings requested within EMBED_BATCH_WINDOW_MS share one /v1/embed call
+# (up to EMBED_BATCH_MAX texts). 0 disables; use 5-20 with threaded (gthread) or async workers.
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "0"))
+EMBED_BATCH_MAX = min(int(os.getenv("EMBED_BATCH_MAX", "96")), 96)
+
+# Batched scoring: query vectors arriving within SCORE_BATCH_WINDOW_MS are scored with one matrix-matrix
+# product (exact float engine). 0 disables; only useful with threaded or async workers.
+SCORE_BATCH_WINDOW_MS = float(os.getenv("SCORE_BATCH_WINDOW_MS", "0"))
+SCORE_BATCH_MAX = int(os.getenv("SCORE_BATCH_MAX", "64"))
+
+# Semantic answer cache: reuse an answer when a new question's embedding is this close to a cached one
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))  # 0 disables
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "3600"))
+
+# Coalesce identical in-flight questions: "local" (threads of one worker), "host" (also across the host's
+# workers, via lock files and a short-lived SQLite result store in COALESCE_DIR) or "off"
+COALESCE = os.getenv("COALESCE", "local")
+COALESCE_DIR = os.getenv("COALESCE_DIR", ".cache/inflight")
+COALESCE_TIMEOUT = float(os.getenv("COALESCE_TIMEOUT", "60"))
+COALESCE_RESULT_TTL = int(os.getenv("COALESCE_RESULT_TTL", "15"))
+
+# Host-local download cache for EMBEDDINGS_URL, shared by all workers
+EMBEDDINGS_CACHE_DIR = os.getenv("EMBEDDINGS_CACHE_DIR", ".cache/embeddings")
+EMBEDDINGS_SHA256 = os.getenv("EMBEDDINGS_SHA256")
+EMBEDDINGS_MAX_AGE = int(os.getenv("EMBEDDINGS_MAX_AGE", "300"))
+
+# Cohere retries: 429/5xx and connection errors back off exponentially with jitter (Retry-After wins)
+COHERE_MAX_RETRIES = int(os.getenv("COHERE_MAX_RETRIES", "3"))
+COHERE_BACKOFF_BASE = float(os.getenv("COHERE_BACKOFF_BASE", "0.5"))
+COHERE_BACKOFF_MAX = float(os.getenv("COHERE_BACKOFF_MAX", "8"))
+COHERE_RETRY_AFTER_MAX = float(os.getenv("COHERE_RETRY_AFTER_MAX", "10"))  # longer Retry-After: fail now
+# Per-endpoint circuit breaker: fail fast for BREAKER_RESET seconds after BREAKER_FAILURES failures in a row
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET = float(os.getenv("BREAKER_RESET", "30"))
+# Hedged embeds: send a second embed request once the first exceeds the recent HEDGE_PERCENTILE latency
+HEDGE_EMBED = os.getenv("HEDGE_EMBED", "false").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+
+# Metrics: GET /metrics serves Prometheus text. Workers share their numbers through small JSON files in
+# METRICS_DIR, rewritten after a request at most every METRICS_FLUSH_INTERVAL seconds, so one scrape
+# covers every worker on the host. An empty METRICS_DIR reports only the worker that answers the scrape.
+METRICS_DIR = os.getenv("METRICS_DIR", ".cache/metrics")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
 # Configure logging
 LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
 logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(message)s")
@@ -26,14 +125,60 @@ logger.info("Environment variables loaded successfully.")
 # Flask app
 app = Flask(__name__)
 
-# Health check endpoint
+# Health check endpoint: answers as soon as the worker imports, before the index is loaded
 @app.route("/health")
 def health():
     return "OK", 200
 
-# Cohere API endpoints
-COHERE_CHAT_URL = "https://api.cohere.com/v2/chat"
-COHERE_EMBED_URL = "https://api.cohere.ai/v1/embed"
+# Readiness: 200 once a retrieval index is active, 503 while it is still loading (or failed to load)
+@app.route("/ready")
+def ready():
+    return readiness()
+
+# -----------------------------
+# Request timing: each request gets a timer; stages (embed, similarity, topk, prompt, chat, render)
+# add to it and the totals go out as a Server-Timing header and into the /metrics histograms
+# -----------------------------
+@app.before_request
+def start_request_timer():
+    metrics.start_request(request.url_rule.rule if request.url_rule else "unmatched")
+
+@app.after_request
+def finish_request_timer(response):
+    timer = metrics.current()
+    if timer is None:
+        return response
+    if response.is_streamed:
+        # Headers are already decided; the timings go out in the stream's done event instead
+        response.response = metrics.iterate_with(timer, response.response, response.status_code)
+    else:
+        response.headers["Server-Timing"] = timer.server_timing()
+        timer.finish(response.status_code)
+    return response
+
+@app.teardown_request
+def clear_request_timer(exc):
+    metrics.end_request()
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics_text(), mimetype="text/plain; version=0.0.4")
+
+# Cohere API: one pooled keep-alive client per worker (see cohere_client.py for COHERE_* pool settings)
+COHERE_EMBED_MODEL = "embed-english-v3.0"
+COHERE_CHAT_MODEL = "command-a-03-2025"
+COHERE_CHAT_URL, COHERE_EMBED_URL = cohere_client.endpoint_urls()
+cohere = cohere_client.from_env(COHERE_API_KEY)
+# Client-side quota shared with other workers and ingest (COHERE_EMBED_RPM etc., see ratelimit.py)
+rate_limiter = ratelimit.from_env()
+RATE_LIMITED_MESSAGE = "Too many questions right now. Please try again in a moment."
+# Every attempt (first try, retry or hedge) is charged to rate_limiter
+upstream = Upstream(
+    max_retries=COHERE_MAX_RETRIES, backoff_base=COHERE_BACKOFF_BASE, backoff_max=COHERE_BACKOFF_MAX,
+    max_retry_after=COHERE_RETRY_AFTER_MAX, breaker_failures=BREAKER_FAILURES, breaker_reset=BREAKER_RESET,
+    hedge_percentile=HEDGE_PERCENTILE, limiter=rate_limiter,
+)
+UNAVAILABLE_MESSAGE = "Cohere is temporarily unavailable. Please try again in a moment."
 
 # -----------------------------
 # Jinja filter: convert seconds → mm:ss
@@ -52,59 +197,497 @@ def format_timestamp(value):
 # -----------------------------
 # Embedding creation
 # -----------------------------
+embed_cache = make_cache(EMBED_CACHE, EMBED_CACHE_PATH, EMBED_CACHE_SIZE, EMBED_CACHE_TTL)
+
+def cached_embeddings(text_list, input_type):
+    """(keys, embeddings, missing): cached vectors (None where absent) and the indices still to fetch."""
+    keys = [f"{COHERE_EMBED_MODEL}|{input_type}|{normalize_question(t)}" for t in text_list]
+    if embed_cache is None:
+        return keys, [None] * len(text_list), list(range(len(text_list)))
+    embeddings = [embed_cache.get(key) for key in keys]
+    return keys, embeddings, [i for i, emb in enumerate(embeddings) if emb is None]
+
+def store_embeddings(keys, embeddings, missing, fetched):
+    for i, emb in zip(missing, fetched):
+        embeddings[i] = emb
+        if embed_cache is not None:
+            embed_cache.put(keys[i], emb)
+    return embeddings
+
 def create_embedding(text_list, input_type="search_query"):
+    """Embeddings for text_list, served from embed_cache where possible; only misses go to Cohere."""
+    keys, embeddings, missing = cached_embeddings(text_list, input_type)
+    if missing:
+        texts = [text_list[i] for i in missing]
+        if embed_batcher is not None and input_type == "search_query":
+            fetched, error = embed_batcher.submit_many(texts)
+        else:
+            fetched, error = request_embeddings(texts, input_type)
+        if error:
+            return None, error
+        store_embeddings(keys, embeddings, missing, fetched)
+    return embeddings, None
+
+def chat_cost(messages):
+    """Rate-limit charge for one chat attempt: the request plus its estimated input tokens."""
+    return {"chat": 1, "tokens": estimate_tokens(*(m["content"] for m in messages))}
+
+def charge_output_tokens(usage):
+    """Charge the chat's billed output tokens to the tokens bucket (input was estimated up front)."""
+    if rate_limiter is not None and usage:
+        rate_limiter.consume({"tokens": usage.get("billed_units", {}).get("output_tokens", 0)})
+
+def request_embeddings(text_list, input_type="search_query"):
     if not COHERE_API_KEY:
         return None, "Cohere API key not configured."
-    headers = {"Authorization": f"Bearer {COHERE_API_KEY}", "Content-Type": "application/json"}
-    data = {"model": "embed-english-v3.0", "texts": text_list, "input_type": input_type}
+    data = {"model": COHERE_EMBED_MODEL, "texts": text_list, "input_type": input_type}
     try:
-        r = requests.post(COHERE_EMBED_URL, headers=headers, json=data, timeout=30)
+        r = upstream.call("embed", lambda: cohere.post(COHERE_EMBED_URL, data), hedge=HEDGE_EMBED, cost={"embed": 1})
         if r.status_code in (429, 402):
             logger.warning("Cohere embed API returned status %s", r.status_code)
             return None, "API limit reached or billing required."
         r.raise_for_status()
         return r.json()["embeddings"], None
+    except CircuitOpenError:
+        return None, UNAVAILABLE_MESSAGE
+    except RateLimited:
+        return None, RATE_LIMITED_MESSAGE
     except Exception as e:
         logger.exception("Error calling Cohere embed API")
         return None, f"Cohere embedding error: {e}"
 
+embed_batcher = None
+if EMBED_BATCH_WINDOW_MS > 0:
+    embed_batcher = MicroBatcher(lambda texts: request_embeddings(texts, "search_query"),
+                                 max_batch=EMBED_BATCH_MAX, window=EMBED_BATCH_WINDOW_MS / 1000)
+
 # Cohere chat inference
 def inference_cohere(messages):
     if not COHERE_API_KEY:
         return None, "Cohere API key not configured."
-    headers = {"Authorization": f"Bearer {COHERE_API_KEY}", "Content-Type": "application/json"}
-    data = {"model": "command-a-03-2025", "messages": messages, "temperature": 0.2}
+    data = {"model": COHERE_CHAT_MODEL, "messages": messages, "temperature": 0.2}
     try:
-        r = requests.post(COHERE_CHAT_URL, headers=headers, json=data, timeout=30)
+        r = upstream.call("chat", lambda: cohere.post(COHERE_CHAT_URL, data), cost=chat_cost(messages))
         if r.status_code in (429, 402):
             logger.warning("Cohere chat API returned status %s", r.status_code)
             return None, "API limit reached or billing required."
         r.raise_for_status()
         response = r.json()
+        charge_output_tokens(response.get("usage"))
         return response["message"]["content"][0]["text"].strip(), None
+    except CircuitOpenError:
+        return None, UNAVAILABLE_MESSAGE
+    except RateLimited:
+        return None, RATE_LIMITED_MESSAGE
     except Exception as e:
         logger.exception("Error calling Cohere chat API")
         return None, f"Cohere chat error: {e}"
 
-# Load precomputed embeddings
-df = None
-if EMBEDDINGS_URL:
-    try:
-        logger.info("Downloading embeddings from %s", EMBEDDINGS_URL)
-        r = requests.get(EMBEDDINGS_URL, timeout=60)
-        r.raise_for_status()
-        df = joblib.load(BytesIO(r.content))
-        logger.info("Loaded %d subtitle chunks from EMBEDDINGS_URL.", len(df))
-    except Exception as e:
-        logger.exception("Failed to download/load embeddings from EMBEDDINGS_URL")
-        df = None
-else:
+def stream_inference_cohere(messages):
+    """Yield answer text as Cohere generates it (v2 chat streaming). Raises on HTTP errors.
+
+    Failures before the first token are retried; once text has been sent they are not.
+    """
+    data = {"model": COHERE_CHAT_MODEL, "messages": messages, "temperature": 0.2, "stream": True}
+    for event in upstream.stream("chat", lambda: cohere.stream(COHERE_CHAT_URL, data), cost=chat_cost(messages)):
+        if event.get("type") == "content-delta":
+            yield event["delta"]["message"]["content"]["text"]
+        elif event.get("type") == "message-end":
+            charge_output_tokens(event.get("delta", {}).get("usage"))
+
+def cohere_error_message(e, api):
+    if isinstance(e, CircuitOpenError):
+        return UNAVAILABLE_MESSAGE
+    if isinstance(e, RateLimited):
+        return RATE_LIMITED_MESSAGE
+    status = getattr(getattr(e, "response", None), "status_code", None)
+    if status in (429, 402):
+        return "API limit reached or billing required."
+    return f"Cohere {api} error: {e}"
+
+# Load precomputed embeddings and build the retrieval index once.
+# NumPy-backed modules (retrieval, index_store, ann, prompt_builder, answer_cache) are imported inside the
+# functions below, which run on the index loader thread, so importing this module stays cheap.
+def is_bundle_url(url):
+    return url.split("?", 1)[0].endswith(".zip")
+
+def fetch_remote():
+    """Local path of EMBEDDINGS_URL's body; one download per host, revalidated with ETag/Last-Modified."""
+    return download_cache.fetch(
+        EMBEDDINGS_URL, EMBEDDINGS_CACHE_DIR, expected_sha256=EMBEDDINGS_SHA256, max_age=EMBEDDINGS_MAX_AGE
+    )
+
+def fetch_bundle():
+    """Unpack the cached index bundle (index_store.py pack) into INDEX_DIR when its version changed."""
+    import index_store
+
+    path = fetch_remote()
+    with download_cache.file_lock(INDEX_DIR.rstrip("/\\") + ".lock"):
+        version = index_store.bundle_manifest(path)["index_version"]
+        if index_store.current_version(INDEX_DIR) == version:
+            return
+        index_store.unpack(path, INDEX_DIR)
+        logger.info("Unpacked index_version %s into %s/.", version, INDEX_DIR)
+
+def load_dataframe():
+    # Legacy pickled DataFrame; only load EMBEDDINGS_URL pickles from a source you trust.
+    # joblib (and pandas, to unpickle it) are imported here so the index-directory path never loads them.
+    import joblib
+
+    if EMBEDDINGS_URL:
+        try:
+            df = joblib.load(fetch_remote())
+            logger.info("Loaded %d subtitle chunks from EMBEDDINGS_URL.", len(df))
+            return df
+        except Exception as e:
+            logger.exception("Failed to download/load embeddings from EMBEDDINGS_URL")
+            return None
     try:
         df = joblib.load("embeddings.joblib")
         logger.info("Loaded %d subtitle chunks.", len(df))
+        return df
     except Exception as e:
         logger.exception("Failed to load local embeddings.joblib")
-        df = None
+        return None
+
+def build_index():
+    import index_store
+    from retrieval import RetrievalIndex
+
+    use_index_dir = not EMBEDDINGS_URL or is_bundle_url(EMBEDDINGS_URL)
+    if EMBEDDINGS_URL and use_index_dir:
+        try:
+            fetch_bundle()
+        except Exception as e:
+            logger.exception("Failed to fetch/unpack index bundle from EMBEDDINGS_URL")
+    # Prefer the versioned index directory: no unpickling, vectors shared by all workers via mmap
+    if use_index_dir and index_store.exists(INDEX_DIR):
+        try:
+            index = index_store.load(
+                INDEX_DIR, quantization=QUANTIZATION, keep_float=KEEP_FLOAT_VECTORS, rescore_factor=RESCORE_FACTOR
+            )
+            if index.manifest["model"] != COHERE_EMBED_MODEL:
+                logger.warning("Index was embedded with %s but queries use %s.",
+                               index.manifest["model"], COHERE_EMBED_MODEL)
+            logger.info("Memory-mapped retrieval index %s from %s/.", index.version, INDEX_DIR)
+            return index
+        except Exception as e:
+            logger.exception("Failed to open index directory %s; falling back to embeddings.joblib", INDEX_DIR)
+        if EMBEDDINGS_URL:
+            return None
+    df = load_dataframe()
+    if df is None:
+        return None
+    try:
+        return RetrievalIndex.from_dataframe(
+            df, quantization=QUANTIZATION, keep_float=KEEP_FLOAT_VECTORS, rescore_factor=RESCORE_FACTOR
+        )
+    except Exception as e:
+        logger.exception("Failed to build retrieval index")
+        return None
+
+def load_index():
+    from prompt_builder import PromptBuilder
+
+    init_request_state()
+    index = build_index()
+    if index is None:
+        return None
+    logger.info("Retrieval index ready: %d chunks x %d dims, engine=%s, %.1f MB of vectors.",
+                len(index), index.dim, index.engine, index.nbytes / 1e6)
+    # Per-row prompt fragments (mm:ss labels, video headers), so requests only join strings
+    index.prompt = PromptBuilder(index)
+    if INDEX_ENGINE == "ivf":
+        try:
+            from ann import IVFIndex
+
+            index.attach_ann(IVFIndex.load(IVF_PATH, nprobe=IVF_NPROBE))
+            logger.info("Using IVF engine from %s (%d lists, nprobe=%d).", IVF_PATH, index.ann.nlist, IVF_NPROBE)
+        except Exception as e:
+            logger.exception("Failed to load IVF index from %s; falling back to exact search", IVF_PATH)
+    return index
+
+def source_version():
+    """Version of the published index, checked by the reload watcher without loading it."""
+    import index_store
+
+    if EMBEDDINGS_URL:
+        path = fetch_remote()
+        if is_bundle_url(EMBEDDINGS_URL):
+            return index_store.bundle_manifest(path)["index_version"]
+        st = os.stat(path)
+        return f"{st.st_size}-{st.st_mtime_ns}"
+    if index_store.exists(INDEX_DIR):
+        return index_store.current_version(INDEX_DIR)
+    st = os.stat("embeddings.joblib")
+    return f"{st.st_size}-{st.st_mtime_ns}"
+
+# Answer cache and batch scorer, created by the first index load (both import NumPy)
+answer_cache = None
+scorer = None
+
+def init_request_state():
+    global answer_cache, scorer
+    if answer_cache is None and ANSWER_CACHE_SIZE > 0:
+        from answer_cache import SemanticAnswerCache
+
+        answer_cache = SemanticAnswerCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL)
+    if scorer is None and SCORE_BATCH_WINDOW_MS > 0:
+        from retrieval import BatchScorer
+
+        scorer = BatchScorer(max_batch=SCORE_BATCH_MAX, window=SCORE_BATCH_WINDOW_MS / 1000)
+    # The Cohere client's HTTP library, so the first question does not import it
+    startup.warm("requests")
+
+inflight = make_single_flight(COALESCE, COALESCE_DIR, COALESCE_TIMEOUT, COALESCE_RESULT_TTL)
+
+def on_index_swap(new, old):
+    if old is None:
+        startup.mark("index loaded")
+        startup.report()
+    elif answer_cache is not None:
+        answer_cache.clear()
+
+index_manager = IndexManager(load_index, source_version, interval=INDEX_RELOAD_INTERVAL)
+index_manager.on_swap(on_index_swap)
+if INDEX_LOAD == "eager":
+    index_manager.reload()
+    index_manager.start()
+else:
+    index_manager.start(load=True)
+
+metrics_snapshots = metrics.WorkerSnapshots(METRICS_DIR, METRICS_FLUSH_INTERVAL) if METRICS_DIR else None
+if metrics_snapshots is not None:
+    metrics.on_request_finished(lambda: metrics_snapshots.maybe_write(collect_metrics))
+
+def counter_families(prefix, label, groups, counters):
+    """One counter family per (stats key, help), labelled by group, from {group: stats dict}."""
+    return [
+        metrics.family(f"{prefix}_{key}_total", "counter", help,
+                       [("", {label: group}, stats.get(key, 0)) for group, stats in groups.items()])
+        for key, help in counters
+    ]
+
+def collect_metrics():
+    """This worker's metrics: request and stage histograms plus cache, upstream and index numbers."""
+    families = metrics.request_families()
+    caches = {name: stats for name, stats in cache_stats().items() if stats and "hits" in stats}
+    families += counter_families("rag_cache", "cache", caches, [("hits", "Cache hits."), ("misses", "Cache misses.")])
+    if inflight is not None:
+        families.append(metrics.family("rag_coalesced_requests_total", "counter",
+                                       "Questions answered by an identical request already in flight.",
+                                       [("", {}, inflight.stats()["coalesced"])]))
+
+    endpoints = upstream.stats()
+    families += counter_families("rag_upstream", "endpoint", endpoints, [
+        ("calls", "Cohere API attempts, retries included."),
+        ("retries", "Cohere API retries after a retryable status or connection error."),
+        ("failures", "Cohere API attempts that failed with a retryable status or connection error."),
+        ("rejected", "Cohere API calls refused locally because the circuit breaker was open."),
+        ("hedges", "Hedged duplicate embed requests sent."),
+    ])
+    families.append(metrics.family("rag_upstream_responses_total", "counter", "Cohere API responses by status code.", [
+        ("", {"endpoint": name, "status": status}, n)
+        for name, stats in endpoints.items() for status, n in stats["status"].items()
+    ]))
+    families.append(metrics.family("rag_upstream_breaker_open", "gauge", "1 while the endpoint's circuit is open.", [
+        ("", {"endpoint": name}, int(stats["breaker"] == "open")) for name, stats in endpoints.items()
+    ]))
+    if rate_limiter is not None:
+        limiter = rate_limiter.stats()
+        families.append(metrics.family("rag_rate_limit_waits_total", "counter",
+                                       "Cohere calls that queued for the client-side rate limit.",
+                                       [("", {}, limiter["waits"])]))
+        families.append(metrics.family("rag_rate_limit_rejected_total", "counter",
+                                       "Cohere calls rejected by the client-side rate limit.",
+                                       [("", {}, limiter["rejected"])]))
+
+    status = index_manager.status()
+    families.append(metrics.family("rag_index_ready", "gauge", "1 once a retrieval index is loaded.",
+                                   [("", {}, int(status["loaded"]))]))
+    families.append(metrics.family("rag_index_chunks", "gauge", "Subtitle chunks in the active index.",
+                                   [("", {}, status["chunks"])]))
+    index = index_manager.current
+    families.append(metrics.family("rag_index_bytes", "gauge", "Memory used by the active index's vectors.",
+                                   [("", {}, index.nbytes if index is not None else 0)]))
+    if status["loaded"]:
+        families.append(metrics.family("rag_index_info", "gauge", "Active index version and engine.", [
+            ("", {"version": status["version"], "engine": status["engine"]}, 1)
+        ]))
+    return families
+
+def metrics_text():
+    families = collect_metrics()
+    if metrics_snapshots is not None:
+        families = metrics.merge([families, *metrics_snapshots.others()])
+    return metrics.render(families + [metrics.ratio(
+        families, "rag_cache_hit_ratio", "Cache hits per lookup.", "rag_cache_hits_total", "rag_cache_misses_total",
+    )])
+
+def readiness():
+    status = index_manager.status()
+    body = {"ready": status["loaded"], "loading": status["loading"], "version": status["version"]}
+    return body, 200 if status["loaded"] else 503
+
+def admin_authorized(headers):
+    return not ADMIN_TOKEN or headers.get("X-Admin-Token") == ADMIN_TOKEN
+
+def cache_stats():
+    return {
+        "query_embeddings": embed_cache.stats() if embed_cache is not None else None,
+        "answers": answer_cache.stats() if answer_cache is not None else None,
+        "in_flight": inflight.stats() if inflight else None,
+    }
+
+def upstream_stats():
+    return {
+        **upstream.stats(),
+        "rate_limiter": rate_limiter.stats() if rate_limiter else None,
+        "embed_batching": embed_batcher.stats() if embed_batcher else None,
+        "score_batching": scorer.stats() if scorer else None,
+    }
+
+def reload_index(args):
+    swapped = index_manager.reload(force=args.get("force", "").lower() in ("1", "true", "yes"))
+    return {"swapped": swapped, **index_manager.status()}
+
+# Admin: active index version, cache counters, Cohere retry/breaker/rate-limit counters and manual reload
+@app.route("/admin/index", methods=["GET"])
+def admin_index():
+    if not admin_authorized(request.headers):
+        return {"error": "unauthorized"}, 401
+    return index_manager.status()
+
+@app.route("/admin/cache", methods=["GET"])
+def admin_cache():
+    if not admin_authorized(request.headers):
+        return {"error": "unauthorized"}, 401
+    return cache_stats()
+
+@app.route("/admin/upstream", methods=["GET"])
+def admin_upstream():
+    if not admin_authorized(request.headers):
+        return {"error": "unauthorized"}, 401
+    return upstream_stats()
+
+@app.route("/admin/index/reload", methods=["POST"])
+def admin_index_reload():
+    if not admin_authorized(request.headers):
+        return {"error": "unauthorized"}, 401
+    return reload_index(request.args)
+
+def retrieval_params(form):
+    """Read top-k and similarity cutoff from the request, falling back to env defaults."""
+    try:
+        k = int(form.get("topK") or TOP_K)
+    except ValueError:
+        k = TOP_K
+    k = max(1, min(k, MAX_TOP_K))
+    try:
+        min_score = float(form["minScore"]) if form.get("minScore") else MIN_SIMILARITY
+    except ValueError:
+        min_score = MIN_SIMILARITY
+    return k, min_score
+
+def prepare_answer(incoming_query, form):
+    """Embed the question and retrieve its context.
+
+    Returns (plan, error). The plan carries either a cached "answer" or the
+    chat "messages" to send, plus what remember_answer() needs to cache it.
+    """
+    plan, error = start_plan(form)
+    if error:
+        return None, error
+    with metrics.stage("embed"):
+        question_embedding, error = create_embedding([incoming_query])
+    if error:
+        return None, error
+    return finish_plan(plan, incoming_query, question_embedding[0])
+
+INDEX_LOADING_MESSAGE = "The lecture index is still loading. Please try again in a few seconds."
+
+def start_plan(form):
+    # Snapshot: a concurrent reload does not affect this request
+    index, index_version = index_manager.current, index_manager.version
+    if index is None:
+        if index_manager.loading:
+            return None, INDEX_LOADING_MESSAGE
+        msg = "Embeddings not loaded. Please set EMBEDDINGS_URL or add embeddings.joblib."
+        logger.warning(msg)
+        return None, msg
+    return {
+        "index": index,
+        "index_version": index_version,
+        "params": retrieval_params(form),
+        "embedding": None,
+        "answer": None,
+        "chunks": None,
+        "messages": None,
+    }, None
+
+def finish_plan(plan, incoming_query, question_embedding):
+    """Answer-cache lookup, top-k search and prompt build for an embedded question."""
+    index = plan["index"]
+    top_results, min_score = plan["params"]
+    plan["embedding"] = question_embedding
+    if answer_cache is not None:
+        with metrics.stage("answer_cache"):
+            cached = answer_cache.lookup(question_embedding, plan["index_version"], plan["params"])
+        if cached is not None:
+            plan["answer"], plan["chunks"] = cached
+            return plan, None
+
+    try:
+        if scorer is not None:
+            # Includes the wait for the batch window; top-k is cut inside the batch
+            with metrics.stage("similarity"):
+                max_indx, scores = scorer.search(index, question_embedding, k=top_results, min_score=min_score)
+        else:
+            max_indx, scores = index.search(question_embedding, k=top_results, min_score=min_score)
+    except Exception as e:
+        logger.exception("Error computing similarity")
+        return None, f"Error computing similarity: {e}"
+
+    if len(max_indx) == 0:
+        return None, "No sufficiently relevant lecture content found."
+    from prompt_builder import PromptBuilder, build_messages
+
+    with metrics.stage("prompt"):
+        chunks, scores = merge_adjacent(index.records(max_indx), scores.tolist(), gap=CONTEXT_MERGE_GAP)
+        chunks = pack_context(chunks, scores, budget=CONTEXT_TOKEN_BUDGET,
+                              chunk_tokens=CONTEXT_CHUNK_TOKENS, score_margin=CONTEXT_SCORE_MARGIN)
+        if index.prompt is None:
+            index.prompt = PromptBuilder(index)
+        plan["chunks"] = chunks
+        plan["messages"] = build_messages(index.prompt.render(chunks), incoming_query)
+    return plan, None
+
+def remember_answer(plan, answer):
+    if answer_cache is not None:
+        answer_cache.put(plan["embedding"], answer, plan["chunks"], plan["index_version"], plan["params"])
+
+def answer_question(incoming_query, form):
+    """(answer, error) for one question: embed, retrieve, then chat unless the answer cache has it."""
+    plan, error = prepare_answer(incoming_query, form)
+    if error:
+        return None, error
+    if plan["answer"] is not None:
+        return plan["answer"], None
+    with metrics.stage("chat"):
+        response, error = inference_cohere(plan["messages"])
+    if error:
+        return None, error
+    remember_answer(plan, response)
+    return response, None
+
+def coalesce_key(incoming_query, form):
+    return json.dumps([index_manager.version, retrieval_params(form), normalize_question(incoming_query)])
+
+def coalesced_answer(incoming_query, form):
+    """answer_question(), shared with identical questions already in flight (see singleflight.py)."""
+    if inflight is None:
+        return answer_question(incoming_query, form)
+    return inflight.do(coalesce_key(incoming_query, form), lambda: answer_question(incoming_query, form))
 
 # Main Flask route
 @app.route("/", methods=["GET", "POST"])
@@ -115,48 +698,98 @@ def result():
     if request.method == "POST":
         incoming_query = request.form.get("queryInput", "").strip()
         if not incoming_query:
-            return render_template("index.html", answer="Please enter a question.", query="")
+            return render_page("Please enter a question.", "")
 
-        if df is None:
-            msg = "Embeddings not loaded. Please set EMBEDDINGS_URL or add embeddings.joblib."
-            logger.warning(msg)
-            return render_template("index.html", answer=msg, query=incoming_query)
-
-        question_embedding, error = create_embedding([incoming_query])
+        response, error = coalesced_answer(incoming_query, request.form)
         if error:
-            return render_template("index.html", answer=error, query=incoming_query)
-        question_embedding = question_embedding[0]
+            return render_page(error, incoming_query)
 
-        try:
-            embeddings_matrix = np.vstack(df["embedding"].values)
-            similarities = cosine_similarity(embeddings_matrix, [question_embedding]).flatten()
-        except Exception as e:
-            logger.exception("Error computing similarity")
-            return render_template("index.html", answer=f"Error computing similarity: {e}", query=incoming_query)
+    return render_page(response, incoming_query)
 
-        top_results = 5
-        max_indx = similarities.argsort()[::-1][:top_results]
-        new_df = df.loc[max_indx].copy()
-        new_df["text"] = new_df["text"].str[:1000]
+def render_page(answer, query):
+    with metrics.stage("render"):
+        return render_template("index.html", answer=answer, query=query)
 
-        prompt_text = f"""I am teaching OpenGL. Here are video subtitle chunks:
+# -----------------------------
+# Streaming answers (Server-Sent Events)
+# -----------------------------
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def stream_answer(incoming_query, form):
+    """SSE events for one question: token* then done, or error. Returns the answer (None on error)."""
+    plan, error = prepare_answer(incoming_query, form)
+    if error:
+        yield sse_event("error", {"message": error})
+        return None
+    if plan["answer"] is not None:
+        yield from replay_answer(plan["answer"])
+        return plan["answer"]
+    parts = []
+    try:
+        with metrics.stage("chat"):
+            for text in stream_inference_cohere(plan["messages"]):
+                parts.append(text)
+                yield sse_event("token", {"text": text})
+    except Exception as e:
+        logger.exception("Error streaming Cohere chat API")
+        yield sse_event("error", {"message": cohere_error_message(e, "chat")})
+        return None
+    answer = "".join(parts).strip()
+    remember_answer(plan, answer)
+    yield sse_event("done", {"answer": answer, "cached": False, "timings": metrics.timings()})
+    return answer
 
-{new_df[['title','number','start','end','text']].to_json(orient='records')}
+def replay_answer(answer):
+    """A finished answer (cached, or shared by a coalesced request) as one token event."""
+    yield sse_event("token", {"text": answer})
+    yield sse_event("done", {"answer": answer, "cached": True, "timings": metrics.timings()})
 
-User asked: "{incoming_query}"
+def coalesced_stream(incoming_query, form):
+    """stream_answer() for the first of several identical questions; the others replay its answer.
 
-Answer in points with timestamps in bold. Only answer course-related questions.
-"""
-        messages = [
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": prompt_text}
-        ]
+    The leader takes no host lock while it streams to its client: it replays
+    an answer another worker already published, or streams its own and
+    publishes it when done.
+    """
+    key = coalesce_key(incoming_query, form)
+    flight, leader = inflight.begin(key)
+    if not leader:
+        result = inflight.wait(flight)
+        if result is not None:
+            yield from replay_answer(result[0])
+        else:
+            yield from stream_answer(incoming_query, form)
+        return
+    answer = None
+    try:
+        shared = inflight.lookup(key)
+        if shared is not None:
+            answer = shared
+            yield from replay_answer(shared)
+            return
+        answer = yield from stream_answer(incoming_query, form)
+        if answer is not None:
+            inflight.publish(key, answer)
+    finally:
+        inflight.finish(key, flight, (answer, None) if answer is not None else None)
 
-        response, error = inference_cohere(messages)
-        if error:
-            return render_template("index.html", answer=error, query=incoming_query)
+@app.route("/stream", methods=["POST"])
+def stream_result():
+    """Same pipeline as "/", but forwards chat tokens as they arrive: token* then done, or error."""
+    incoming_query = request.form.get("queryInput", "").strip()
+    form = request.form.copy()  # the generator runs after this request context is gone
+    if not incoming_query:
+        events = iter([sse_event("error", {"message": "Please enter a question."})])
+    elif inflight is None:
+        events = stream_answer(incoming_query, form)
+    else:
+        events = coalesced_stream(incoming_query, form)
+    return Response(events, mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-    return render_template("index.html", answer=response, query=incoming_query)
+startup.mark("app imported")
+startup.report()
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
@@ -0,0 +1,348 @@
+import asyncio
+import contextvars
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# -----------------------------
+# Request metrics: per-stage timings, Server-Timing headers and Prometheus text exposition
+# -----------------------------
+# Upper bounds in seconds: sub-millisecond search up to slow chat completions
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_current = contextvars.ContextVar("request_timer", default=None)
+_finished_hooks = []
+
+
+class Histogram:
+    """Cumulative Prometheus histogram with one set of buckets per label combination."""
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect(self):
+        samples = []
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._series.items()):
+                labels = dict(zip(self.labels, label_values))
+                for bound, n in zip(self.buckets, counts):
+                    samples.append(("_bucket", {**labels, "le": _number(bound)}, n))
+                samples.append(("_bucket", {**labels, "le": "+Inf"}, count))
+                samples.append(("_sum", labels, total))
+                samples.append(("_count", labels, count))
+        return family(self.name, "histogram", self.help, samples)
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, n=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + n
+
+    def collect(self):
+        with self._lock:
+            samples = [("", dict(zip(self.labels, k)), v) for k, v in sorted(self._values.items())]
+        return family(self.name, "counter", self.help, samples)
+
+
+STAGE_SECONDS = Histogram("rag_stage_seconds", "Time spent in each stage of answering a request.", ["stage"])
+REQUEST_SECONDS = Histogram("rag_request_seconds", "End-to-end request latency.", ["route"])
+REQUESTS = Counter("rag_requests_total", "Requests served.", ["route", "status"])
+
+
+class RequestTimer:
+    """Stage durations of one request; ``stage()`` adds to whichever timer is active in the current context."""
+
+    def __init__(self, route):
+        self.route = route
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.streaming = False
+        self.finished = False
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def timings(self):
+        """{stage: milliseconds}, plus the total so far."""
+        result = {name: round(seconds * 1000, 1) for name, seconds in self.stages.items()}
+        result["total"] = round((time.perf_counter() - self.started) * 1000, 1)
+        return result
+
+    def server_timing(self):
+        """Server-Timing header value, e.g. ``embed;dur=120.3, chat;dur=1480.0, total;dur=1610.2``."""
+        return ", ".join(f"{name};dur={ms}" for name, ms in self.timings().items())
+
+    def finish(self, status):
+        """Record the request's stages and total in the histograms (once)."""
+        if self.finished:
+            return
+        self.finished = True
+        for name, seconds in self.stages.items():
+            STAGE_SECONDS.observe(seconds, name)
+        REQUEST_SECONDS.observe(time.perf_counter() - self.started, self.route)
+        REQUESTS.inc(self.route, str(status))
+        for hook in _finished_hooks:
+            hook()
+
+
+def start_request(route):
+    timer = RequestTimer(route)
+    _current.set(timer)
+    return timer
+
+
+def current():
+    return _current.get()
+
+
+def end_request():
+    _current.set(None)
+
+
+def timings():
+    """The current request's timings so far (see RequestTimer.timings), or None outside a request."""
+    timer = _current.get()
+    return timer.timings() if timer is not None else None
+
+
+def on_request_finished(callback):
+    """Run callback() after each request's timings are recorded (e.g. to share them with other workers)."""
+    _finished_hooks.append(callback)
+
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as ``name`` on the current request (no-op outside a request)."""
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - started)
+
+
+@contextmanager
+def untimed():
+    """Work done on behalf of other requests (e.g. a micro-batch leader) is not charged to this one."""
+    token = _current.set(None)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def iterate_with(timer, iterable, status=200):
+    """Stream ``iterable`` with ``timer`` active while each item is produced, then finish it.
+
+    Streamed bodies are produced after the view (and its request context) has
+    returned, so the timer is finished by the stream rather than by the
+    after-request hook (``timer.streaming`` tells the hook).
+    """
+    timer.streaming = True
+    return _iterate_with(timer, iterable, status)
+
+
+def _iterate_with(timer, iterable, status):
+    iterator = iter(iterable)
+    try:
+        while True:
+            token = _current.set(timer)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                _current.reset(token)
+            yield item
+    finally:
+        timer.finish(status)
+
+
+def aiterate_with(timer, iterable, status=200):
+    """Async counterpart of iterate_with() for async generators."""
+    timer.streaming = True
+    return _aiterate_with(timer, iterable, status)
+
+
+async def _aiterate_with(timer, iterable, status):
+    iterator = iterable.__aiter__()
+    try:
+        while True:
+            token = _current.set(timer)
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+            finally:
+                _current.reset(token)
+            yield item
+    finally:
+        # Off the event loop: the on_request_finished hooks may do file and SQLite I/O
+        await asyncio.to_thread(timer.finish, status)
+
+
+# -----------------------------
+# Exposition
+# -----------------------------
+def family(name, kind, help, samples):
+    """A metric family: samples are (suffix, labels, value) tuples."""
+    return {"name": name, "type": kind, "help": help, "samples": [list(s) for s in samples]}
+
+
+def _number(value):
+    value = float(value)
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render(families):
+    """Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for fam in families:
+        lines.append(f"# HELP {fam['name']} {fam['help']}")
+        lines.append(f"# TYPE {fam['name']} {fam['type']}")
+        for suffix, labels, value in fam["samples"]:
+            label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+            lines.append(f"{fam['name']}{suffix}{{{label_text}}} {_number(value)}" if label_text
+                         else f"{fam['name']}{suffix} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def merge(snapshots):
+    """Combine families from several workers: counters and histograms add up, gauges take the maximum."""
+    merged, order = {}, []
+    for families in snapshots:
+        for fam in families:
+            target = merged.get(fam["name"])
+            if target is None:
+                target = merged[fam["name"]] = {**fam, "samples": [], "_index": {}}
+                order.append(fam["name"])
+            for suffix, labels, value in fam["samples"]:
+                key = (suffix, tuple(sorted(labels.items())))
+                i = target["_index"].get(key)
+                if i is None:
+                    target["_index"][key] = len(target["samples"])
+                    target["samples"].append([suffix, labels, value])
+                elif fam["type"] == "gauge":
+                    target["samples"][i][2] = max(target["samples"][i][2], value)
+                else:
+                    target["samples"][i][2] += value
+    return [{k: v for k, v in merged[name].items() if k != "_index"} for name in order]
+
+
+def ratio(families, name, help, hits, misses):
+    """Gauge of hits / (hits + misses) per label set, from two counter families (0 when there were none)."""
+    values = {fam["name"]: {tuple(sorted(labels.items())): value for _, labels, value in fam["samples"]}
+              for fam in families if fam["name"] in (hits, misses)}
+    hit_values, miss_values = values.get(hits, {}), values.get(misses, {})
+    samples = []
+    for key in sorted(set(hit_values) | set(miss_values)):
+        lookups = hit_values.get(key, 0) + miss_values.get(key, 0)
+        samples.append(("", dict(key), hit_values.get(key, 0) / lookups if lookups else 0.0))
+    return family(name, "gauge", help, samples)
+
+
+def request_families():
+    return [STAGE_SECONDS.collect(), REQUEST_SECONDS.collect(), REQUESTS.collect()]
+
+
+class WorkerSnapshots:
+    """Shares each worker's metrics with its siblings through JSON files in ``directory``.
+
+    A worker rewrites its own file at most every ``interval`` seconds, after a
+    request; a scrape, which reaches one worker, merges its live metrics with the
+    files of the other workers that are still running. Files of exited workers
+    are removed, so their counters drop out (Prometheus treats that as a reset).
+    """
+
+    def __init__(self, directory, interval=5.0):
+        self.directory = directory
+        self.interval = interval
+        self._written = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f"worker-{pid}.json")
+
+    def maybe_write(self, collect):
+        now = time.monotonic()
+        if now - self._written < self.interval or not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._written = now
+            path = self._path(os.getpid())
+            tmp = f"{path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(collect(), f)
+            os.replace(tmp, path)
+        finally:
+            self._lock.release()
+
+    def others(self):
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, "worker-*.json")):
+            try:
+                pid = int(os.path.basename(path)[7:-5])
+            except ValueError:
+                continue
+            if pid == os.getpid():
+                continue
+            if not _alive(pid):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path, encoding="utf-8") as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+
+def _alive(pid):
+    if os.name == "nt":  # os.kill() would terminate the process there
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
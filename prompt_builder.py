@@ -0,0 +1,99 @@
+import numpy as np
+
+from chunk_store import is_known
+
+# -----------------------------
+# Chat prompt: compact per-chunk rendering, precomputed per index
+# -----------------------------
+SYSTEM_PROMPT = "You are a helpful assistant."
+
+PROMPT_TEMPLATE = """I am teaching OpenGL. Here are video subtitle excerpts, grouped by video, each with its time range:
+
+{context}
+
+User asked: "{question}"
+
+Answer in points with timestamps in bold. Only answer course-related questions.
+"""
+
+MAX_TITLE_CHARS = 60
+
+
+def mmss(seconds):
+    """Seconds -> M:SS (H:MM:SS past an hour), rounded to the nearest second."""
+    total = int(round(float(seconds)))
+    hours, rest = divmod(total, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{secs:02d}"
+    return f"{minutes}:{secs:02d}"
+
+
+def video_header(title, number):
+    """Short header line for one video, e.g. "## Video 3: Vertex buffers"."""
+    title, number = str(title).strip(), str(number).strip()
+    if len(title) > MAX_TITLE_CHARS:
+        title = title[:MAX_TITLE_CHARS - 1].rstrip() + "…"
+    parts = []
+    if is_known(number):
+        parts.append(f"Video {number}")
+    if is_known(title):
+        parts.append(title)
+    return "## " + (": ".join(parts) if parts else "Lecture video")
+
+
+class PromptBuilder:
+    """Prompt fragments for every row of a RetrievalIndex, computed once when it is loaded.
+
+    Each row gets its video id and mm:ss start/end labels, and each video one
+    header line, so building a prompt on the request path only joins strings.
+    Rows whose title or number is a placeholder ("Unknown", "N/A", ...) may
+    come from any lecture, so each of them is rendered as a video of its own.
+    Chunks are the dicts from RetrievalIndex.records(), possibly merged by
+    context.merge_adjacent() (``id`` is the first row, ``end_id`` the last).
+    """
+
+    def __init__(self, index):
+        chunks = index.chunks
+        # A video is a distinct (title id, number id) pair of the interned columns
+        stride = max(1, len(chunks.number_table))
+        keys, video_ids = np.unique(chunks.title_ids.astype(np.int64) * stride + chunks.number_ids,
+                                    return_inverse=True)
+        self.video_ids = video_ids.astype(np.int32)
+        known_titles = np.array([is_known(t) for t in chunks.title_table], dtype=bool)
+        known_numbers = np.array([is_known(n) for n in chunks.number_table], dtype=bool)
+        self.known = known_titles[chunks.title_ids] & known_numbers[chunks.number_ids]
+        self.headers = [
+            video_header(chunks.title_table[key // stride], chunks.number_table[key % stride])
+            for key in keys.tolist()
+        ]
+        self.start_labels = [mmss(s) for s in chunks.starts]
+        self.end_labels = [mmss(e) for e in chunks.ends]
+
+    def render(self, chunks):
+        """Context block: videos in order of their best chunk, their excerpts in time order.
+
+        A chunk of an unknown video gets a block of its own, so excerpts of
+        different lectures are never sorted into one timeline.
+        """
+        videos = {}
+        for chunk in chunks:
+            row = chunk["id"]
+            key = int(self.video_ids[row]) if self.known[row] else ("row", row)
+            videos.setdefault(key, []).append(chunk)
+        blocks = []
+        for members in videos.values():
+            lines = [self.headers[self.video_ids[members[0]["id"]]]]
+            for chunk in sorted(members, key=lambda c: c["start"]):
+                span = f"{self.start_labels[chunk['id']]}-{self.end_labels[chunk.get('end_id', chunk['id'])]}"
+                lines.append(f"[{span}] {chunk['text']}")
+            blocks.append("\n".join(lines))
+        return "\n\n".join(blocks)
+
+
+def build_messages(context, question):
+    """Chat messages for a rendered context block and the user's question."""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": PROMPT_TEMPLATE.format(context=context, question=question)},
+    ]
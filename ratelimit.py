@@ -0,0 +1,190 @@
+import os
+import sqlite3
+import threading
+import time
+
+# -----------------------------
+# Token-bucket rate limiter for the Cohere key, shared by workers and ingest
+# -----------------------------
+class RateLimited(Exception):
+    """Raised when a call would have to queue longer than ``max_wait`` seconds."""
+
+
+def estimate_tokens(*texts):
+    """Rough token count (about 4 characters per token) used to pre-charge the tokens bucket."""
+    return sum(len(t) for t in texts) // 4 + 1
+
+
+class MemoryRateLimiter:
+    """Token buckets in this process only. ``limits`` maps bucket -> amount allowed per minute.
+
+    ``reserve`` takes from every named bucket at once and returns how long the
+    caller must wait for its turn. Buckets may go negative: that is the queue,
+    so concurrent callers are spaced out in arrival order instead of all
+    retrying at the same instant. A reservation that would wait longer than
+    ``max_wait`` takes nothing and raises RateLimited.
+    """
+
+    def __init__(self, limits, max_wait=10.0):
+        self.limits = {name: float(per_minute) for name, per_minute in limits.items() if per_minute}
+        self.max_wait = max_wait
+        self.waits = 0
+        self.waited = 0.0
+        self.rejected = 0
+        self._state = {}
+        self._lock = threading.Lock()
+
+    def _load(self, names):
+        return {name: self._state.get(name) for name in names}
+
+    def _store(self, state):
+        self._state.update(state)
+
+    def _transaction(self):
+        return self._lock
+
+    def reserve(self, amounts):
+        """Take ``amounts`` (bucket -> units) now and return the seconds to wait before using them."""
+        try:
+            wait = self._take(amounts, self.max_wait)
+        except RateLimited:
+            self.rejected += 1
+            raise
+        if wait > 0:
+            self.waits += 1
+            self.waited += wait
+        return wait
+
+    def _take(self, amounts, max_wait):
+        amounts = {name: n for name, n in amounts.items() if name in self.limits and n > 0}
+        if not amounts:
+            return 0.0
+        now = time.time()
+        with self._transaction():
+            state = self._load(amounts)
+            wait, updated = 0.0, {}
+            for name, n in amounts.items():
+                capacity = self.limits[name]
+                rate = capacity / 60.0
+                level, stamp = state[name] or (capacity, now)
+                level = min(capacity, level + (now - stamp) * rate) - min(n, capacity)
+                wait = max(wait, -level / rate)
+                updated[name] = (level, now)
+            if wait > max_wait:
+                raise RateLimited(f"Cohere rate limit: would wait {wait:.1f}s for {', '.join(amounts)}.")
+            self._store(updated)
+        return wait
+
+    def acquire(self, amounts):
+        """Block until ``amounts`` (bucket -> units) may be spent."""
+        wait = self.reserve(amounts)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def try_acquire(self, amounts):
+        """Take ``amounts`` only if they are available right now (for optional calls such as hedges)."""
+        try:
+            self._take(amounts, 0.0)
+            return True
+        except RateLimited:
+            return False
+
+    def consume(self, amounts):
+        """Charge usage known only after the call (e.g. output tokens) without waiting."""
+        self._take(amounts, float("inf"))
+
+    def stats(self):
+        return {
+            "backend": "memory",
+            "limits_per_minute": self.limits,
+            "max_wait": self.max_wait,
+            "waits": self.waits,
+            "waited_seconds": round(self.waited, 3),
+            "rejected": self.rejected,
+        }
+
+
+class SqliteRateLimiter(MemoryRateLimiter):
+    """Buckets in a local SQLite file, so every gunicorn worker and create_embedding.py
+    on the host draw from the same quota. Counters in stats() are per process."""
+
+    def __init__(self, path, limits, max_wait=10.0):
+        super().__init__(limits, max_wait)
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, level REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def _load(self, names):
+        conn = self._conn()
+        state = dict.fromkeys(names)
+        for name, level, updated in conn.execute(
+            f"SELECT name, level, updated FROM buckets WHERE name IN ({','.join('?' * len(state))})", list(state)
+        ):
+            state[name] = (level, updated)
+        return state
+
+    def _store(self, state):
+        self._conn().executemany(
+            "INSERT OR REPLACE INTO buckets (name, level, updated) VALUES (?, ?, ?)",
+            [(name, level, updated) for name, (level, updated) in state.items()],
+        )
+
+    def _transaction(self):
+        return _Immediate(self._conn())
+
+    def stats(self):
+        stats = super().stats()
+        stats.update(backend="sqlite", path=self.path)
+        return stats
+
+
+class _Immediate:
+    """BEGIN IMMEDIATE ... COMMIT: serializes read-modify-write across processes."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def from_env(max_wait=None):
+    """Limiter from COHERE_EMBED_RPM / COHERE_CHAT_RPM / COHERE_TOKENS_PER_MINUTE (0 = unlimited).
+
+    RATE_LIMIT_BACKEND is "sqlite" (default, file at RATE_LIMIT_PATH), "memory"
+    or "off"; RATE_LIMIT_MAX_WAIT (or ``max_wait``) caps how long a call
+    queues. Returns None when no limit is configured.
+    """
+    limits = {
+        "embed": float(os.getenv("COHERE_EMBED_RPM", "0")),
+        "chat": float(os.getenv("COHERE_CHAT_RPM", "0")),
+        "tokens": float(os.getenv("COHERE_TOKENS_PER_MINUTE", "0")),
+    }
+    backend = os.getenv("RATE_LIMIT_BACKEND", "sqlite").lower()
+    if max_wait is None:
+        max_wait = float(os.getenv("RATE_LIMIT_MAX_WAIT", "10"))
+    if not any(limits.values()) or backend in ("off", "none", "0", "false"):
+        return None
+    if backend == "memory":
+        return MemoryRateLimiter(limits, max_wait)
+    if backend == "sqlite":
+        return SqliteRateLimiter(os.getenv("RATE_LIMIT_PATH", ".cache/ratelimit.sqlite"), limits, max_wait)
+    raise ValueError(f"Unknown rate limit backend {backend!r}; use sqlite, memory or off.")
@@ -0,0 +1,370 @@
+import asyncio
+import email.utils
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Retry with jittered backoff, circuit breaker and hedged requests for upstream calls
+# -----------------------------
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint whose breaker is open."""
+
+
+class CircuitBreaker:
+    """Per-endpoint breaker: opens after ``failure_threshold`` consecutive failures.
+
+    While open, calls fail fast for ``reset_timeout`` seconds; then one trial
+    call is let through (half-open) and its outcome closes or re-opens it.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._trial_running = False
+            if self.state == "half_open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.opens += 1
+                    logger.warning("Circuit breaker opened after %d failures.", self.failures)
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self._trial_running = False
+
+    def release(self):
+        """Give back a half-open trial that ended without an outcome (cancelled or abandoned)."""
+        with self._lock:
+            self._trial_running = False
+
+
+def retry_after_seconds(response):
+    """Seconds from a Retry-After header (delta-seconds or HTTP-date), else None."""
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def _status(e):
+    return getattr(getattr(e, "response", None), "status_code", None)
+
+
+class Upstream:
+    """Resilient wrapper for calls to one upstream service, tracked per endpoint name.
+
+    ``call(endpoint, fn)`` runs ``fn()`` (which returns an HTTP response) and
+    retries 429/5xx responses and connection errors with full-jitter
+    exponential backoff, honouring Retry-After up to ``max_retry_after``. A
+    breaker per endpoint fails fast while the service is degraded. With
+    ``hedge=True`` a second identical request is sent when the first has not
+    answered within the recent ``hedge_percentile`` latency.
+
+    With a ``limiter`` (ratelimit.py), a call's ``cost`` (bucket -> units) is
+    charged before every attempt, so retries are paid for too; a hedge is only
+    sent when its cost is available without waiting.
+    """
+
+    def __init__(self, max_retries=3, backoff_base=0.5, backoff_max=8.0, max_retry_after=10.0,
+                 breaker_failures=5, breaker_reset=30.0, hedge_percentile=95, hedge_min_delay=0.05, limiter=None):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+        self.breaker_failures = breaker_failures
+        self.breaker_reset = breaker_reset
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.limiter = limiter
+        self.breakers = {}
+        self.counters = {}
+        self.latencies = {}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    # -- bookkeeping --
+    def _endpoint(self, name):
+        with self._lock:
+            if name not in self.breakers:
+                self.breakers[name] = CircuitBreaker(self.breaker_failures, self.breaker_reset)
+                self.counters[name] = {"calls": 0, "retries": 0, "failures": 0, "rejected": 0,
+                                       "hedges": 0, "hedge_wins": 0, "status": {}}
+                self.latencies[name] = deque(maxlen=200)
+            return self.breakers[name]
+
+    def _count(self, name, key, n=1):
+        with self._lock:
+            self.counters[name][key] += n
+
+    def _count_status(self, name, status):
+        with self._lock:
+            codes = self.counters[name]["status"]
+            codes[str(status)] = codes.get(str(status), 0) + 1
+
+    def _delay(self, attempt, response=None):
+        """Backoff before retry ``attempt`` (1-based), or None when Retry-After is too long to wait."""
+        retry_after = retry_after_seconds(response)
+        if retry_after is not None:
+            return retry_after if retry_after <= self.max_retry_after else None
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1))))
+
+    def hedge_delay(self, name):
+        samples = sorted(self.latencies.get(name, ()))
+        if len(samples) < 20:
+            return None
+        rank = min(len(samples) - 1, int(len(samples) * self.hedge_percentile / 100))
+        return max(self.hedge_min_delay, samples[rank])
+
+    def _before(self, name):
+        breaker = self._endpoint(name)
+        if not breaker.allow():
+            self._count(name, "rejected")
+            raise CircuitOpenError(f"Cohere {name} endpoint is temporarily unavailable (circuit open).")
+        self._count(name, "calls")
+        return breaker
+
+    def _charge(self, breaker, cost):
+        """Wait for the limiter before an attempt; a RateLimited attempt gives back a half-open trial."""
+        if self.limiter is None or not cost:
+            return
+        try:
+            self.limiter.acquire(cost)
+        except BaseException:
+            breaker.release()
+            raise
+
+    def _can_hedge(self, cost):
+        return self.limiter is None or not cost or self.limiter.try_acquire(cost)
+
+    def _outcome(self, name, breaker, response=None, error=None):
+        """Record a finished attempt; returns True when it should be retried."""
+        status = response.status_code if response is not None else _status(error)
+        if status is not None:
+            self._count_status(name, status)
+        if status in RETRYABLE_STATUS or (error is not None and status is None):
+            breaker.record_failure()
+            self._count(name, "failures")
+            return True
+        # Any other answer (including a 4xx) means the service itself is up
+        breaker.record_success()
+        return False
+
+    # -- synchronous --
+    def call(self, name, fn, hedge=False, cost=None):
+        attempt = 0
+        while True:
+            breaker = self._before(name)
+            self._charge(breaker, cost)
+            started = time.perf_counter()
+            response = error = None
+            try:
+                response = self._hedged(name, fn, cost) if hedge else fn()
+            except Exception as e:
+                error = e
+            except BaseException:
+                breaker.release()
+                raise
+            retry = self._outcome(name, breaker, response, error)
+            if not retry:
+                self.latencies[name].append(time.perf_counter() - started)
+                return response
+            attempt += 1
+            delay = self._delay(attempt, response) if attempt <= self.max_retries else None
+            if delay is None:
+                if error is not None:
+                    raise error
+                return response
+            self._count(name, "retries")
+            logger.info("Retrying Cohere %s in %.2fs (attempt %d, %s).", name, delay, attempt,
+                        response.status_code if response is not None else type(error).__name__)
+            time.sleep(delay)
+
+    def _hedged(self, name, fn, cost=None):
+        delay = self.hedge_delay(name)
+        if delay is None:
+            return fn()
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hedge")
+        first = self._executor.submit(fn)
+        done, _ = wait([first], timeout=delay)
+        if done or not self._can_hedge(cost):
+            return first.result()
+        self._count(name, "hedges")
+        second = self._executor.submit(fn)
+        done, _ = wait([first, second], return_when=FIRST_COMPLETED)
+        winner = done.pop()
+        if winner.exception() is not None:
+            winner = second if winner is first else first
+        if winner is second:
+            self._count(name, "hedge_wins")
+        return winner.result()
+
+    def stream(self, name, open_stream, cost=None):
+        """Iterate ``open_stream()``; failures before the first item are retried like call()."""
+        attempt = 0
+        while True:
+            breaker = self._before(name)
+            self._charge(breaker, cost)
+            started = False
+            try:
+                for item in open_stream():
+                    started = True
+                    yield item
+                self._outcome(name, breaker)
+                return
+            except Exception as e:
+                retry = self._outcome(name, breaker, error=e)
+                attempt += 1
+                delay = None
+                if retry and not started and attempt <= self.max_retries:
+                    delay = self._delay(attempt, getattr(e, "response", None))
+                if delay is None:
+                    raise
+                self._count(name, "retries")
+                time.sleep(delay)
+            except BaseException:
+                # Abandoned (client disconnect: GeneratorExit) or cancelled; give back a half-open trial
+                breaker.release()
+                raise
+
+    # -- asyncio (asgi.py) --
+    async def _acharge(self, breaker, cost):
+        """_charge() for the event loop: the limiter (possibly SQLite) runs in a thread, the wait is a sleep."""
+        if self.limiter is None or not cost:
+            return
+        try:
+            await asyncio.sleep(await asyncio.to_thread(self.limiter.reserve, cost))
+        except BaseException:
+            breaker.release()
+            raise
+
+    async def _acan_hedge(self, cost):
+        return self.limiter is None or not cost or await asyncio.to_thread(self.limiter.try_acquire, cost)
+
+    async def acall(self, name, fn, hedge=False, cost=None):
+        attempt = 0
+        while True:
+            breaker = self._before(name)
+            await self._acharge(breaker, cost)
+            started = time.perf_counter()
+            response = error = None
+            try:
+                response = await (self._ahedged(name, fn, cost) if hedge else fn())
+            except Exception as e:
+                error = e
+            except BaseException:
+                breaker.release()
+                raise
+            retry = self._outcome(name, breaker, response, error)
+            if not retry:
+                self.latencies[name].append(time.perf_counter() - started)
+                return response
+            attempt += 1
+            delay = self._delay(attempt, response) if attempt <= self.max_retries else None
+            if delay is None:
+                if error is not None:
+                    raise error
+                return response
+            self._count(name, "retries")
+            await asyncio.sleep(delay)
+
+    async def _ahedged(self, name, fn, cost=None):
+        delay = self.hedge_delay(name)
+        if delay is None:
+            return await fn()
+        first = asyncio.ensure_future(fn())
+        done, _ = await asyncio.wait([first], timeout=delay)
+        if done or not await self._acan_hedge(cost):
+            return await first
+        self._count(name, "hedges")
+        second = asyncio.ensure_future(fn())
+        done, pending = await asyncio.wait([first, second], return_when=asyncio.FIRST_COMPLETED)
+        winner = done.pop()
+        if winner.exception() is not None and pending:
+            winner = pending.pop()
+            await asyncio.wait([winner])
+        for task in pending:
+            task.cancel()
+        if winner is second:
+            self._count(name, "hedge_wins")
+        return winner.result()
+
+    async def astream(self, name, open_stream, cost=None):
+        attempt = 0
+        while True:
+            breaker = self._before(name)
+            await self._acharge(breaker, cost)
+            started = False
+            try:
+                async for item in open_stream():
+                    started = True
+                    yield item
+                self._outcome(name, breaker)
+                return
+            except Exception as e:
+                retry = self._outcome(name, breaker, error=e)
+                attempt += 1
+                delay = None
+                if retry and not started and attempt <= self.max_retries:
+                    delay = self._delay(attempt, getattr(e, "response", None))
+                if delay is None:
+                    raise
+                self._count(name, "retries")
+                await asyncio.sleep(delay)
+            except BaseException:
+                # Abandoned (client disconnect: GeneratorExit) or cancelled; give back a half-open trial
+                breaker.release()
+                raise
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: {
+                    **{k: (dict(v) if isinstance(v, dict) else v) for k, v in self.counters[name].items()},
+                    "breaker": self.breakers[name].state,
+                    "breaker_opens": self.breakers[name].opens,
+                    "hedge_delay": self.hedge_delay(name),
+                }
+                for name in self.breakers
+            }
@@ -0,0 +1,267 @@
+import hashlib
+import threading
+
+import numpy as np
+
+import metrics
+from batching import MicroBatcher
+from chunk_store import ChunkStore
+from quantize import BinaryEngine, Int8Engine, quantize_binary, quantize_int8
+
+# -----------------------------
+# Retrieval index: built once, scored per query
+# -----------------------------
+def normalize_rows(matrix):
+    """L2-normalize each row of a 2-D array in place-safe fashion."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def normalize_query(query_embedding):
+    query = np.asarray(query_embedding, dtype=np.float32).ravel()
+    norm = np.linalg.norm(query)
+    return query / norm if norm else query
+
+
+def top_k(scores, k, min_score=None):
+    """Indices and scores of the k best entries, best first.
+
+    Uses argpartition so only the k winners are sorted instead of the whole
+    score vector.
+    """
+    n = scores.shape[0]
+    k = min(max(int(k), 0), n)
+    if k == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=scores.dtype)
+    if k < n:
+        ids = np.argpartition(scores, n - k)[n - k:]
+    else:
+        ids = np.arange(n)
+    ids = ids[np.argsort(scores[ids])[::-1]]
+    best = scores[ids]
+    if min_score is not None:
+        keep = best >= min_score
+        ids, best = ids[keep], best[keep]
+    return ids, best
+
+
+def top_k_rows(scores, k):
+    """Row-wise top_k() for a 2-D score matrix: (ids, scores), each of shape (rows, k), best first."""
+    n = scores.shape[1]
+    k = min(max(int(k), 0), n)
+    if k < n:
+        ids = np.argpartition(scores, n - k, axis=1)[:, n - k:]
+    else:
+        ids = np.broadcast_to(np.arange(n), scores.shape)
+    best = np.take_along_axis(scores, ids, axis=1)
+    order = np.argsort(-best, axis=1, kind="stable")
+    return np.take_along_axis(ids, order, axis=1), np.take_along_axis(best, order, axis=1)
+
+
+def _cut(ids, best, k, min_score):
+    ids, best = ids[:k], best[:k]
+    if min_score is not None:
+        keep = best >= min_score
+        ids, best = ids[keep], best[keep]
+    return ids, best
+
+
+class RetrievalIndex:
+    """Exact cosine-similarity index over subtitle chunk embeddings.
+
+    Vectors are stored once as a contiguous, L2-normalized float32 matrix so a
+    query is scored with a single matrix-vector product. An approximate
+    (``ann``) or quantized first-pass engine can be attached on top. Chunk
+    metadata lives in a ChunkStore (no pandas on the serving path).
+    """
+
+    def __init__(self, vectors, chunks, normalized=False, dim=None):
+        if vectors is None:
+            # Quantized-only index: a first-pass engine must be attached before searching
+            self.vectors = None
+            self.dim = dim
+        else:
+            vectors = np.asarray(vectors, dtype=np.float32)
+            if vectors.ndim != 2:
+                raise ValueError("Embedding matrix must be 2-D.")
+            # Pre-normalized (e.g. memory-mapped) matrices are used as-is, without a copy
+            self.vectors = np.ascontiguousarray(vectors if normalized else normalize_rows(vectors))
+            self.dim = self.vectors.shape[1]
+        self.chunks = chunks
+        self.ann = None
+        self.quantized = None
+        self.rescore_factor = 4
+        self.manifest = None
+        self.prompt = None  # prompt_builder.PromptBuilder, attached by the app after loading
+
+    @classmethod
+    def from_dataframe(cls, df, quantization="none", keep_float=True, rescore_factor=4):
+        """Build from a legacy embeddings.joblib DataFrame (the caller has pandas loaded)."""
+        if "embedding" not in df.columns or df["embedding"].isnull().all():
+            raise ValueError("No embeddings found in dataframe.")
+        vectors = np.array(df["embedding"].tolist(), dtype=np.float32)
+        chunks = ChunkStore.from_columns(
+            df["title"].tolist(), df["number"].tolist(), df["start"].to_numpy(), df["end"].to_numpy(), df["text"].tolist()
+        )
+        index = cls(vectors, chunks)
+        if quantization == "int8":
+            if "embedding_int8" in df.columns:
+                codes = np.array(df["embedding_int8"].tolist(), dtype=np.int8)
+            else:
+                codes = quantize_int8(index.vectors)
+            index.attach_quantized(Int8Engine(codes), keep_float, rescore_factor)
+        elif quantization == "binary":
+            if "embedding_ubinary" in df.columns:
+                packed = np.array(df["embedding_ubinary"].tolist(), dtype=np.uint8)
+            else:
+                packed = quantize_binary(index.vectors)
+            index.attach_quantized(BinaryEngine(packed, index.dim), keep_float, rescore_factor)
+        elif quantization not in ("none", "", None):
+            raise ValueError(f"Unknown quantization {quantization!r}; use none, int8 or binary.")
+        return index
+
+    def __len__(self):
+        return len(self.chunks)
+
+    @property
+    def version(self):
+        """Content id from the on-disk manifest (None for indexes built from a DataFrame)."""
+        return None if self.manifest is None else self.manifest["index_version"]
+
+    @property
+    def fingerprint(self):
+        """index_version, or a checksum of the float vectors; ties an ANN file to the corpus it was built on."""
+        if self.version is not None:
+            return self.version
+        return "sha256:" + hashlib.sha256(np.ascontiguousarray(self.vectors)).hexdigest()[:16]
+
+    @property
+    def engine(self):
+        if self.quantized is not None:
+            return self.quantized.name
+        return "exact" if self.ann is None else type(self.ann).__name__
+
+    @property
+    def nbytes(self):
+        """Bytes held by vector data (float matrix and/or quantized codes)."""
+        total = 0 if self.vectors is None else self.vectors.nbytes
+        return total + (0 if self.quantized is None else self.quantized.nbytes)
+
+    def score(self, query_embedding):
+        """Cosine similarity of one query against every chunk."""
+        query = normalize_query(query_embedding)
+        if self.vectors is None:
+            return self.quantized.rescore(query)
+        return self.vectors @ query
+
+    def attach_ann(self, ann):
+        """Use an approximate engine for search(); exact scoring stays available."""
+        if self.vectors is None:
+            raise ValueError("ANN search needs the float vectors; disable quantization or keep float vectors.")
+        if ann.ntotal != len(self):
+            raise ValueError(f"ANN index covers {ann.ntotal} rows but the corpus has {len(self)}.")
+        if ann.index_version != self.fingerprint:
+            raise ValueError(f"ANN index was built for index {ann.index_version} but this corpus is "
+                             f"{self.fingerprint}; rebuild it with python ann.py build.")
+        self.ann = ann
+
+    def attach_quantized(self, engine, keep_float=True, rescore_factor=4):
+        """Search the quantized codes first, then rescore a shortlist of k * rescore_factor rows.
+
+        With keep_float=False the float32 matrix is released and the shortlist is
+        rescored against the quantized codes instead.
+        """
+        if engine.ntotal != len(self):
+            raise ValueError(f"Quantized codes cover {engine.ntotal} rows but the corpus has {len(self)}.")
+        self.quantized = engine
+        self.rescore_factor = max(1, int(rescore_factor))
+        if not keep_float:
+            self.vectors = None
+
+    def search(self, query_embedding, k=5, min_score=None, exact=False):
+        """Top-k chunk ids and cosine scores for one query (timed as the similarity and topk stages)."""
+        query = normalize_query(query_embedding)
+        if self.quantized is not None and not exact:
+            with metrics.stage("similarity"):
+                cand = self.quantized.shortlist(query, k * self.rescore_factor)
+                if self.vectors is not None:
+                    scores = self.vectors[cand] @ query
+                else:
+                    scores = self.quantized.rescore(query, cand)
+            with metrics.stage("topk"):
+                ids, best = top_k(scores, k, min_score)
+            return cand[ids], best
+        if self.ann is None or exact:
+            with metrics.stage("similarity"):
+                scores = self.score(query)
+            with metrics.stage("topk"):
+                return top_k(scores, k, min_score)
+        # IVF probes and ranks in one pass
+        with metrics.stage("similarity"):
+            return self.ann.search(self.vectors, query, k, min_score)
+
+    def search_batch(self, query_embeddings, k=5, min_score=None, out=None):
+        """search() for several queries: one matrix-matrix product instead of one GEMV each.
+
+        ``out`` is an optional preallocated float32 buffer with at least
+        ``len(query_embeddings)`` rows of ``len(self)`` scores. Quantized and
+        ANN engines fall back to per-query search(). Returns [(ids, scores), ...].
+        """
+        if self.vectors is None or self.quantized is not None or self.ann is not None:
+            return [self.search(q, k, min_score) for q in query_embeddings]
+        queries = normalize_rows(np.asarray(query_embeddings, dtype=np.float32).reshape(-1, self.dim))
+        scores = np.matmul(queries, self.vectors.T, out=None if out is None else out[:len(queries)])
+        ids, best = top_k_rows(scores, k)
+        return [_cut(ids[i], best[i], k, min_score) for i in range(len(queries))]
+
+    def records(self, ids):
+        """Chunk metadata for the given row ids, in order."""
+        return [self.chunks.record(i) for i in ids]
+
+class BatchScorer:
+    """Scores queries from concurrent requests together (see batching.MicroBatcher).
+
+    Queries that arrive within ``window`` seconds are stacked and scored with
+    RetrievalIndex.search_batch() into one reused output buffer; top-k is then
+    cut per request, so each keeps its own k and min_score. Queries against
+    different index objects (during a hot reload) are scored separately.
+    """
+
+    def __init__(self, max_batch=64, window=0.002):
+        self.batcher = MicroBatcher(self._score, max_batch, window)
+        self._out = None
+        self._lock = threading.Lock()
+
+    def search(self, index, query_embedding, k=5, min_score=None):
+        """Same result as index.search(); raises RuntimeError if batched scoring failed."""
+        result, error = self.batcher.submit((index, query_embedding, k, min_score))
+        if error:
+            raise RuntimeError(error)
+        return result
+
+    def _buffer(self, rows, cols):
+        if self._out is None or self._out.shape[0] < rows or self._out.shape[1] != cols:
+            self._out = np.empty((max(rows, self.batcher.max_batch), cols), dtype=np.float32)
+        return self._out
+
+    def _score(self, items):
+        groups = {}
+        for pos, (index, _, _, _) in enumerate(items):
+            groups.setdefault(id(index), []).append(pos)
+        results = [None] * len(items)
+        # One batch at a time: the output buffer is shared and BLAS already uses every core.
+        # The leader runs this for the whole batch; each request times its own wait instead.
+        with self._lock, metrics.untimed():
+            for positions in groups.values():
+                index = items[positions[0]][0]
+                kmax = max(items[pos][2] for pos in positions)
+                queries = [items[pos][1] for pos in positions]
+                found = index.search_batch(queries, kmax, out=self._buffer(len(queries), len(index)))
+                for pos, (ids, best) in zip(positions, found):
+                    _, _, k, min_score = items[pos]
+                    results[pos] = _cut(ids, best, k, min_score)
+        return results, None
+
+    def stats(self):
+        return self.batcher.stats()
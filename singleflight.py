@@ -0,0 +1,295 @@
+import asyncio
+import contextlib
+import hashlib
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, each worker computes on its own
+    fcntl = None
+
+from cache import SqliteCache
+
+# -----------------------------
+# Single-flight: identical concurrent questions share one computation
+# -----------------------------
+@contextlib.contextmanager
+def key_lock(path, timeout=None):
+    """Exclusive flock on a per-key file, removed again on release so files do not pile up.
+
+    Yields True once the lock is held, or False when ``timeout`` seconds pass
+    first (the caller then goes on without it). The lock is polled rather
+    than waited on, so the deadline holds however long the holder takes. A
+    waiter that gets the lock on a file its holder already unlinked retries
+    on the current one, so two workers never both hold the same key.
+    """
+    if fcntl is None:
+        yield True
+        return
+    deadline = None if timeout is None else time.monotonic() + timeout
+    delay = 0.005
+    while True:
+        f = open(path, "a+")
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            try:
+                current = os.stat(path).st_ino == os.fstat(f.fileno()).st_ino
+            except FileNotFoundError:
+                current = False
+        except BlockingIOError:
+            current = None
+        except BaseException:
+            f.close()
+            raise
+        if current:
+            break
+        f.close()
+        if current is None:  # held by another worker
+            if deadline is not None and time.monotonic() >= deadline:
+                yield False
+                return
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+    try:
+        yield True
+    finally:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        f.close()  # releases the lock
+
+
+class _Flight:
+    def __init__(self, future=None):
+        self.done = threading.Event()
+        self.future = future
+        self.result = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key onto one in-flight computation.
+
+    The first caller for a key (the leader) runs ``fn``; callers that arrive
+    while it runs wait and receive the same result. ``fn`` follows the repo's
+    ``(value, error)`` convention. A follower whose leader failed or exceeded
+    ``timeout`` computes the result itself.
+
+    With ``lock_dir`` and ``store`` (a cache.SqliteCache), leaders in other
+    worker processes on the host are coalesced too. A lock file per key
+    serializes them (different questions never wait on each other), and the
+    first one's value is published to ``store`` for the workers that were
+    waiting on the lock. A worker that waits longer than ``timeout`` for the
+    lock computes the result itself. Only values without an error are
+    shared, and the store's TTL should be short.
+    """
+
+    def __init__(self, timeout=60, lock_dir=None, store=None):
+        self.timeout = timeout
+        self.lock_dir = lock_dir
+        self.store = store
+        self.leaders = 0
+        self.followers = 0
+        self.shared = 0
+        self.fallbacks = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+
+    def _lock_path(self, key):
+        return os.path.join(self.lock_dir, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".lock")
+
+    # -- threads (main.py) --
+    def begin(self, key):
+        """(flight, is_leader). A leader must call finish(); a follower calls wait()."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.followers += 1
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            self.leaders += 1
+            return flight, True
+
+    def finish(self, key, flight, result):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.result = result
+        flight.done.set()
+
+    def wait(self, flight):
+        """Leader's (value, error), or None when it timed out, failed or gave up."""
+        if flight.done.wait(self.timeout) and flight.result is not None and flight.result[1] is None:
+            return flight.result
+        self.fallbacks += 1
+        return None
+
+    def do(self, key, fn):
+        flight, leader = self.begin(key)
+        if not leader:
+            result = self.wait(flight)
+            return result if result is not None else fn()
+        result = None
+        try:
+            result = self._run_shared(key, fn)
+            return result
+        finally:
+            self.finish(key, flight, result)
+
+    @property
+    def cross_worker(self):
+        return bool(self.lock_dir) and self.store is not None
+
+    @contextlib.contextmanager
+    def host_flight(self, key):
+        """Cross-worker section for a leader: yields (value, publish).
+
+        ``value`` is what another worker already published for ``key`` (or
+        None); otherwise compute it and call ``publish(value)`` before leaving.
+        A no-op section when cross-worker coalescing is off. The host lock is
+        held for the whole section, so it suits computations that finish
+        before anything is sent to a client; streaming leaders use lookup()
+        and publish() instead.
+        """
+        if not self.cross_worker:
+            yield None, lambda value: None
+            return
+        with key_lock(self._lock_path(key), self.timeout) as locked:
+            if not locked:
+                self.fallbacks += 1
+            value = self.store.get(key)
+            if value is not None:
+                self.shared += 1
+            yield value, lambda value: self.store.put(key, value)
+
+    def lookup(self, key):
+        """Value another worker already published for ``key``, or None. Takes no lock."""
+        if not self.cross_worker:
+            return None
+        value = self.store.get(key)
+        if value is not None:
+            self.shared += 1
+        return value
+
+    def publish(self, key, value):
+        """Share a finished value with the other workers (no-op when cross-worker coalescing is off)."""
+        if self.cross_worker:
+            self.store.put(key, value)
+
+    def _run_shared(self, key, fn):
+        with self.host_flight(key) as (value, publish):
+            if value is not None:
+                return value, None
+            result = fn()
+            if result[1] is None:
+                publish(result[0])
+            return result
+
+    # -- asyncio (asgi.py) --
+    def abegin(self, key):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.followers += 1
+                return flight, False
+            flight = self._flights[key] = _Flight(asyncio.get_running_loop().create_future())
+            self.leaders += 1
+            return flight, True
+
+    def afinish(self, key, flight, result):
+        self.finish(key, flight, result)
+        if not flight.future.done():
+            flight.future.set_result(result)
+
+    async def await_(self, flight):
+        try:
+            result = await asyncio.wait_for(asyncio.shield(flight.future), self.timeout)
+        except asyncio.TimeoutError:
+            result = None
+        if result is not None and result[1] is None:
+            return result
+        self.fallbacks += 1
+        return None
+
+    async def ado(self, key, fn):
+        flight, leader = self.abegin(key)
+        if not leader:
+            result = await self.await_(flight)
+            return result if result is not None else await fn()
+        result = None
+        try:
+            result = await self._arun_shared(key, fn)
+            return result
+        finally:
+            self.afinish(key, flight, result)
+
+    @contextlib.asynccontextmanager
+    async def ahost_flight(self, key):
+        """Async host_flight() yielding (value, async publish).
+
+        The lock polling and the SQLite store run in threads so the event loop keeps serving.
+        """
+        if not self.cross_worker:
+            yield None, _discard
+            return
+        lock = key_lock(self._lock_path(key), self.timeout)
+        if not await asyncio.to_thread(lock.__enter__):
+            self.fallbacks += 1
+        try:
+            value = await asyncio.to_thread(self.store.get, key)
+            if value is not None:
+                self.shared += 1
+
+            async def publish(value):
+                await asyncio.to_thread(self.store.put, key, value)
+
+            yield value, publish
+        finally:
+            lock.__exit__(None, None, None)
+
+    async def alookup(self, key):
+        return await asyncio.to_thread(self.lookup, key)
+
+    async def apublish(self, key, value):
+        if self.cross_worker:
+            await asyncio.to_thread(self.store.put, key, value)
+
+    async def _arun_shared(self, key, fn):
+        async with self.ahost_flight(key) as (value, publish):
+            if value is not None:
+                return value, None
+            result = await fn()
+            if result[1] is None:
+                await publish(result[0])
+            return result
+
+    def stats(self):
+        return {
+            "in_flight": len(self._flights),
+            "leaders": self.leaders,
+            "coalesced": self.followers,
+            "shared_across_workers": self.shared,
+            "fallbacks": self.fallbacks,
+            "cross_worker": self.cross_worker,
+        }
+
+
+async def _discard(value):
+    return None
+
+
+def make_single_flight(mode, directory=None, timeout=60, result_ttl=15):
+    """Build from config: mode is "local" (one worker), "host" (all workers on the host) or "off" (None)."""
+    mode = (mode or "off").lower()
+    if mode == "local":
+        return SingleFlight(timeout)
+    if mode == "host":
+        store = SqliteCache(os.path.join(directory, "results.sqlite"), max_entries=1024, ttl=result_ttl)
+        return SingleFlight(timeout, lock_dir=directory, store=store)
+    if mode in ("off", "none", "0", "false"):
+        return None
+    raise ValueError(f"Unknown coalescing mode {mode!r}; use local, host or off.")
@@ -0,0 +1,69 @@
+import builtins
+import logging
+import os
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Worker startup: import-time profile and background warm-up of lazily imported modules
+# -----------------------------
+PROCESS_START = time.perf_counter()
+_imports = {}
+_marks = []
+_depth = 0
+
+
+def _profiled_import(name, globals=None, locals=None, fromlist=(), level=0, _import=builtins.__import__):
+    global _depth
+    top = name.partition(".")[0]
+    if level or top in sys.modules:
+        return _import(name, globals, locals, fromlist, level)
+    _depth += 1
+    started = time.perf_counter()
+    try:
+        return _import(name, globals, locals, fromlist, level)
+    finally:
+        _depth -= 1
+        # Inclusive time of each first import; nested ones are reported under their own name too
+        _imports.setdefault(top, (time.perf_counter() - started, _depth))
+
+
+def install_import_profile():
+    """Record how long each module's first import takes when IMPORT_PROFILE is set (real env, not .env)."""
+    if os.getenv("IMPORT_PROFILE", "").lower() in ("1", "true", "yes") and builtins.__import__ is not _profiled_import:
+        builtins.__import__ = _profiled_import
+
+
+def profiling():
+    return builtins.__import__ is _profiled_import
+
+
+def mark(label):
+    """Record a startup milestone (seconds since this module was imported)."""
+    _marks.append((label, time.perf_counter() - PROCESS_START))
+    if profiling():
+        logger.info("startup: %s after %.3fs", label, _marks[-1][1])
+
+
+def report(top=15):
+    """Log the slowest imports and the milestones so far; returns them as a dict."""
+    slowest = sorted(_imports.items(), key=lambda item: -item[1][0])[:top]
+    if profiling():
+        logger.info("Import profile (inclusive seconds, nesting depth):\n%s", "\n".join(
+            f"  {seconds:8.3f}  {'  ' * depth}{name}" for name, (seconds, depth) in slowest
+        ))
+    return {
+        "imports": {name: round(seconds, 4) for name, (seconds, _) in slowest},
+        "marks": {label: round(seconds, 4) for label, seconds in _marks},
+    }
+
+
+def warm(*modules):
+    """Import modules the request path imports lazily, so the first request does not pay for them."""
+    for name in modules:
+        try:
+            __import__(name)  # through builtins.__import__, so the import profile sees it
+        except ImportError:
+            logger.debug("Warm-up import of %s skipped", name)
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import index_store
+from ann import IVFIndex
+from retrieval import RetrievalIndex
+
+
+def frame(vectors):
+    n = len(vectors)
+    return pd.DataFrame({
+        "title": [f"Lecture {i % 3}" for i in range(n)],
+        "number": [str(i % 3 + 1) for i in range(n)],
+        "start": np.arange(n, dtype=float) * 10,
+        "end": np.arange(n, dtype=float) * 10 + 10,
+        "text": [f"chunk {i}" for i in range(n)],
+        "embedding": list(vectors),
+    })
+
+
+@pytest.fixture
+def vectors():
+    return np.random.default_rng(0).normal(size=(64, 16)).astype(np.float32)
+
+
+def test_ivf_round_trip_attaches_to_its_corpus(vectors, tmp_path):
+    index = RetrievalIndex.from_dataframe(frame(vectors))
+    path = tmp_path / "ivf.npz"
+    IVFIndex.build(index.vectors, nlist=4, index_version=index.fingerprint).save(path)
+    index.attach_ann(IVFIndex.load(path, nprobe=4))
+    ids, _ = index.search(index.vectors[5], k=1)
+    assert ids[0] == 5
+
+
+def test_ivf_for_reordered_rows_is_refused(vectors, tmp_path):
+    index = RetrievalIndex.from_dataframe(frame(vectors))
+    path = tmp_path / "ivf.npz"
+    IVFIndex.build(index.vectors, nlist=4, index_version=index.fingerprint).save(path)
+    reordered = RetrievalIndex.from_dataframe(frame(vectors[::-1]))
+    with pytest.raises(ValueError, match="rebuild"):
+        reordered.attach_ann(IVFIndex.load(path))
+
+
+def test_ivf_follows_index_directory_version(vectors, tmp_path):
+    first = index_store.save_dataframe(frame(vectors), str(tmp_path / "a"))
+    second = index_store.save_dataframe(frame(vectors[::-1]), str(tmp_path / "b"))
+    ivf = IVFIndex.build(first.vectors, nlist=4, index_version=first.version)
+    first.attach_ann(ivf)
+    with pytest.raises(ValueError):
+        second.attach_ann(ivf)
+
+
+def test_ivf_without_recorded_version_is_refused(vectors, tmp_path):
+    index = RetrievalIndex.from_dataframe(frame(vectors))
+    path = tmp_path / "old.npz"
+    ivf = IVFIndex.build(index.vectors, nlist=4)
+    np.savez(path, centroids=ivf.centroids, order=ivf.order, offsets=ivf.offsets)
+    with pytest.raises(ValueError):
+        index.attach_ann(IVFIndex.load(path))
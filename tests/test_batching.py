@@ -0,0 +1,66 @@
+import asyncio
+import threading
+
+from batching import AsyncMicroBatcher, MicroBatcher
+
+
+def doubled(items):
+    return [item * 2 for item in items], None
+
+
+def test_concurrent_submits_share_one_batch():
+    batches = []
+
+    def process(items):
+        batches.append(list(items))
+        return doubled(items)
+
+    batcher = MicroBatcher(process, max_batch=8, window=0.2)
+    results = {}
+    threads = [threading.Thread(target=lambda n=n: results.__setitem__(n, batcher.submit(n))) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == {n: (n * 2, None) for n in range(4)}
+    assert len(batches) == 1
+    assert batcher.stats()["largest_batch"] == 4
+
+
+def test_submit_many_keeps_order_and_splits_at_max_batch():
+    sizes = []
+
+    def process(items):
+        sizes.append(len(items))
+        return doubled(items)
+
+    batcher = MicroBatcher(process, max_batch=3, window=0.01)
+    assert batcher.submit_many([1, 2, 3, 4, 5]) == ([2, 4, 6, 8, 10], None)
+    assert sizes == [3, 2]
+
+
+def test_errors_reach_every_caller():
+    batcher = MicroBatcher(lambda items: (None, "upstream down"), window=0.01)
+    assert batcher.submit(1) == (None, "upstream down")
+
+    def broken(items):
+        raise RuntimeError("boom")
+
+    assert MicroBatcher(broken, window=0.01).submit(1) == (None, "RuntimeError: boom")
+    short = MicroBatcher(lambda items: ([1], None), window=0.01)
+    assert short.submit_many([1, 2])[1].startswith("Batched call returned 1 results")
+
+
+def test_async_submits_share_one_batch():
+    batches = []
+
+    async def process(items):
+        batches.append(list(items))
+        return doubled(items)
+
+    async def scenario():
+        batcher = AsyncMicroBatcher(process, max_batch=8, window=0.05)
+        return await asyncio.gather(batcher.submit(1), batcher.submit_many([2, 3]), batcher.submit(4))
+
+    assert asyncio.run(scenario()) == [(2, None), ([4, 6], None), (8, None)]
+    assert batches == [[1, 2, 3, 4]]
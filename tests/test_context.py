@@ -0,0 +1,60 @@
+from context import count_tokens, merge_adjacent, pack_context, trim_to_tokens
+
+
+def chunk(id, start, end, text, title="Shaders", number="3"):
+    return {"id": id, "title": title, "number": number, "start": start, "end": end, "text": text}
+
+
+def sentences(prefix, n):
+    return " ".join(f"{prefix} sentence number {i} is here." for i in range(n))
+
+
+def test_trim_keeps_whole_sentences():
+    text = "One two three. Four five six. Seven eight nine."
+    assert trim_to_tokens(text, 9) == "One two three. Four five six."
+    assert trim_to_tokens(text, 100) == text
+    assert trim_to_tokens("a b c d e f g h", 4) == "a b c…"
+
+
+def test_merge_joins_adjacent_chunks_and_drops_repeats():
+    chunks = [chunk(1, 10, 20, "Alpha. Beta."), chunk(2, 19, 30, "Beta. Gamma."), chunk(7, 100, 110, "Far away.")]
+    merged, scores = merge_adjacent(chunks, [0.9, 0.8, 0.5])
+    assert [m["text"] for m in merged] == ["Alpha. Beta. Gamma.", "Far away."]
+    assert (merged[0]["start"], merged[0]["end"], merged[0]["end_id"]) == (10, 30, 2)
+    assert scores == [0.9, 0.5]
+
+
+def test_trimmed_merged_span_ends_where_its_text_ends():
+    first, second = sentences("First", 10), sentences("Second", 10)
+    merged, scores = merge_adjacent([chunk(1, 0, 30, first), chunk(2, 30, 60, second)], [0.9, 0.8])
+    assert merged[0]["end_id"] == 2
+    [packed] = pack_context(merged, scores, chunk_tokens=count_tokens(first) + 5)
+    assert packed["text"] == first
+    assert (packed["end"], packed["end_id"]) == (30, 1)
+    assert "member_ends" not in packed
+
+
+def test_untrimmed_merged_span_keeps_its_end():
+    merged, scores = merge_adjacent([chunk(1, 0, 30, "Alpha."), chunk(2, 30, 60, "Beta.")], [0.9, 0.8])
+    [packed] = pack_context(merged, scores)
+    assert (packed["end"], packed["end_id"]) == (60, 2)
+
+
+def test_pack_respects_budget_and_margin():
+    chunks = [chunk(i, i * 100, i * 100 + 30, sentences(f"C{i}", 5), number=str(i)) for i in range(4)]
+    packed = pack_context(chunks, [0.9, 0.85, 0.6, 0.88], budget=10_000, score_margin=0.1)
+    assert [c["id"] for c in packed] == [0, 3, 1]
+    tight = pack_context(chunks, [0.9, 0.85, 0.6, 0.88], budget=60, min_tokens=10)
+    assert sum(count_tokens(c["text"]) + 12 for c in tight) <= 60
+
+
+def test_chunks_of_unknown_videos_are_not_merged():
+    # Placeholder title/number says nothing about which lecture a chunk came from
+    chunks = [
+        chunk(1, 117.6, 120.56, "Bind the buffer. Then draw.", title="Unknown", number="N/A"),
+        chunk(2, 118.1, 145.5, "Then draw. Lighting uses normals.", title="Unknown", number="N/A"),
+    ]
+    merged, scores = merge_adjacent(chunks, [0.9, 0.8])
+    assert [m["text"] for m in merged] == ["Bind the buffer. Then draw.", "Then draw. Lighting uses normals."]
+    assert [(m["start"], m["end"]) for m in merged] == [(117.6, 120.56), (118.1, 145.5)]
+    assert scores == [0.9, 0.8]
@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+
+from prompt_builder import PromptBuilder
+from retrieval import RetrievalIndex
+
+
+def index(titles, numbers, starts):
+    n = len(titles)
+    return RetrievalIndex.from_dataframe(pd.DataFrame({
+        "title": titles,
+        "number": numbers,
+        "start": np.array(starts, dtype=float),
+        "end": np.array(starts, dtype=float) + 10,
+        "text": [f"chunk {i}" for i in range(n)],
+        "embedding": list(np.eye(n, dtype=np.float32)),
+    }))
+
+
+def test_known_video_excerpts_are_grouped_in_time_order():
+    built = index(["Shaders", "Shaders"], ["3", "3"], [60, 0])
+    prompt = PromptBuilder(built)
+    assert prompt.render(built.records([0, 1])) == "## Video 3: Shaders\n[0:00-0:10] chunk 1\n[1:00-1:10] chunk 0"
+
+
+def test_unknown_video_excerpts_keep_their_own_blocks_in_score_order():
+    built = index(["Unknown"] * 3, ["N/A"] * 3, [60, 0, 30])
+    prompt = PromptBuilder(built)
+    assert prompt.render(built.records([0, 1, 2])) == (
+        "## Lecture video\n[1:00-1:10] chunk 0\n\n"
+        "## Lecture video\n[0:00-0:10] chunk 1\n\n"
+        "## Lecture video\n[0:30-0:40] chunk 2"
+    )
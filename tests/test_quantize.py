@@ -0,0 +1,31 @@
+import numpy as np
+
+from quantize import BinaryEngine, Int8Engine, quantize_binary, quantize_int8
+
+
+def unit_rows(n=500, dim=64, seed=0):
+    vectors = np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_int8_scores_approximate_cosine():
+    vectors = unit_rows()
+    engine = Int8Engine(quantize_int8(vectors))
+    query = vectors[42]
+    scores = engine.rescore(query)
+    assert scores.dtype == np.float32
+    assert np.abs(scores - vectors @ query).max() < 0.02
+    assert scores.argmax() == 42
+    np.testing.assert_allclose(engine.rescore(query, np.array([42, 7])), scores[[42, 7]])
+
+
+def test_int8_zero_query_scores_zero():
+    engine = Int8Engine(quantize_int8(unit_rows()))
+    assert not engine.rescore(np.zeros(64, dtype=np.float32)).any()
+
+
+def test_shortlists_contain_the_nearest_row():
+    vectors = unit_rows()
+    query = vectors[3]
+    assert 3 in Int8Engine(quantize_int8(vectors)).shortlist(query, 5)
+    assert 3 in BinaryEngine(quantize_binary(vectors), 64).shortlist(query, 5)
@@ -0,0 +1,41 @@
+import time
+
+import pytest
+
+from ratelimit import MemoryRateLimiter, RateLimited, SqliteRateLimiter
+
+
+def test_calls_over_the_limit_queue_in_arrival_order():
+    limiter = MemoryRateLimiter({"chat": 60}, max_wait=5)  # one call per second
+    waits = [limiter.reserve({"chat": 1}) for _ in range(62)]
+    assert waits[:60] == [0.0] * 60
+    assert waits[60] == pytest.approx(1.0, abs=0.05)
+    assert waits[61] == pytest.approx(2.0, abs=0.05)
+
+
+def test_wait_beyond_max_wait_takes_nothing():
+    limiter = MemoryRateLimiter({"embed": 60}, max_wait=0.5)
+    for _ in range(60):
+        limiter.reserve({"embed": 1})
+    with pytest.raises(RateLimited):
+        limiter.reserve({"embed": 1})
+    assert limiter.stats()["rejected"] == 1
+    assert not limiter.try_acquire({"embed": 1})
+
+
+def test_unlimited_buckets_are_ignored():
+    limiter = MemoryRateLimiter({"embed": 0, "chat": 60}, max_wait=0)
+    assert limiter.reserve({"embed": 1000}) == 0.0
+
+
+def test_sqlite_buckets_are_shared(tmp_path):
+    path = str(tmp_path / "ratelimit.sqlite")
+    first = SqliteRateLimiter(path, {"chat": 60}, max_wait=0)
+    second = SqliteRateLimiter(path, {"chat": 60}, max_wait=0)
+    for _ in range(60):
+        assert first.try_acquire({"chat": 1})
+    assert not second.try_acquire({"chat": 1})
+    first.consume({"chat": 5})  # charged after the fact, even past the limit
+    time.sleep(0.01)
+    with pytest.raises(RateLimited):
+        second.reserve({"chat": 1})
@@ -0,0 +1,141 @@
+import asyncio
+import time
+
+import pytest
+
+from ratelimit import MemoryRateLimiter, RateLimited
+from resilience import CircuitOpenError, Upstream
+
+
+class Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def failing():
+    raise ConnectionError("down")
+
+
+def half_open(upstream, name="chat"):
+    """Open ``name``'s breaker and wait out its reset, so the next call is the half-open trial."""
+    with pytest.raises(ConnectionError):
+        upstream.call(name, failing)
+    assert upstream.breakers[name].state == "open"
+    with pytest.raises(CircuitOpenError):
+        upstream.call(name, lambda: Response(200))
+    time.sleep(upstream.breaker_reset + 0.01)
+
+
+def make_upstream():
+    return Upstream(max_retries=0, breaker_failures=1, breaker_reset=0.05)
+
+
+def test_retries_retryable_status_then_succeeds():
+    upstream = Upstream(max_retries=2, backoff_base=0.001)
+    responses = iter([Response(503), Response(429, {"Retry-After": "0"}), Response(200)])
+    assert upstream.call("embed", lambda: next(responses)).status_code == 200
+    stats = upstream.stats()["embed"]
+    assert stats["retries"] == 2
+    assert stats["status"] == {"503": 1, "429": 1, "200": 1}
+    assert stats["breaker"] == "closed"
+
+
+def test_client_error_does_not_trip_breaker():
+    upstream = Upstream(max_retries=0, breaker_failures=1)
+    assert upstream.call("chat", lambda: Response(400)).status_code == 400
+    assert upstream.breakers["chat"].state == "closed"
+
+
+def test_half_open_trial_closes_breaker():
+    upstream = make_upstream()
+    half_open(upstream)
+    assert upstream.call("chat", lambda: Response(200)).status_code == 200
+    assert upstream.breakers["chat"].state == "closed"
+
+
+def test_abandoned_stream_releases_half_open_trial():
+    upstream = make_upstream()
+    half_open(upstream)
+    stream = upstream.stream("chat", lambda: iter(["a", "b", "c"]))
+    assert next(stream) == "a"
+    stream.close()  # the /stream client disconnected
+    assert upstream.call("chat", lambda: Response(200)).status_code == 200
+    assert upstream.breakers["chat"].state == "closed"
+
+
+def test_cancelled_async_stream_releases_half_open_trial():
+    upstream = make_upstream()
+    half_open(upstream)
+
+    async def tokens():
+        yield "a"
+        await asyncio.sleep(10)
+        yield "b"
+
+    async def consume():
+        async for _ in upstream.astream("chat", tokens):
+            pass
+
+    async def scenario():
+        task = asyncio.ensure_future(consume())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        async def ok():
+            return Response(200)
+
+        return await upstream.acall("chat", ok)
+
+    assert asyncio.run(scenario()).status_code == 200
+    assert upstream.breakers["chat"].state == "closed"
+
+
+def test_cancelled_async_call_releases_half_open_trial():
+    upstream = make_upstream()
+    half_open(upstream)
+
+    async def slow():
+        await asyncio.sleep(10)
+
+    async def ok():
+        return Response(200)
+
+    async def scenario():
+        task = asyncio.ensure_future(upstream.acall("chat", slow))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return await upstream.acall("chat", ok)
+
+    assert asyncio.run(scenario()).status_code == 200
+
+
+def test_every_attempt_is_charged_to_the_limiter():
+    limiter = MemoryRateLimiter({"chat": 60}, max_wait=0)
+    limiter._state["chat"] = (2.0, time.time())  # two calls left in the bucket
+    upstream = Upstream(max_retries=3, backoff_base=0.001, limiter=limiter)
+    responses = iter([Response(503), Response(503), Response(200)])
+    with pytest.raises(RateLimited):
+        upstream.call("chat", lambda: next(responses), cost={"chat": 1})
+    assert upstream.stats()["chat"]["calls"] == 3
+    assert upstream.stats()["chat"]["failures"] == 2  # the limiter's refusal is not an upstream failure
+
+
+@pytest.mark.parametrize("budget, hedges", [(1.0, 0), (2.0, 1)])
+def test_hedge_needs_budget(budget, hedges):
+    limiter = MemoryRateLimiter({"embed": 60}, max_wait=0)
+    limiter._state["embed"] = (budget, time.time())
+    upstream = Upstream(hedge_min_delay=0.01, limiter=limiter)
+    upstream._endpoint("embed")
+    upstream.latencies["embed"].extend([0.001] * 20)
+
+    def slow():
+        time.sleep(0.05)
+        return Response(200)
+
+    assert upstream.call("embed", slow, hedge=True, cost={"embed": 1}).status_code == 200
+    assert upstream.stats()["embed"]["hedges"] == hedges
@@ -0,0 +1,108 @@
+import asyncio
+import os
+import threading
+import time
+
+from singleflight import SingleFlight, make_single_flight
+
+
+def run_threads(*targets):
+    threads = [threading.Thread(target=t) for t in targets]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def test_local_callers_share_one_computation():
+    flight = SingleFlight(timeout=5)
+    calls = []
+    results = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return "answer", None
+
+    run_threads(*[lambda: results.append(flight.do("q", compute))] * 4)
+    assert len(calls) == 1
+    assert results == [("answer", None)] * 4
+    assert flight.stats()["coalesced"] == 3
+
+
+def test_failed_leader_is_not_shared():
+    flight = SingleFlight(timeout=5)
+    assert flight.do("q", lambda: (None, "boom")) == (None, "boom")
+    assert flight.do("q", lambda: ("ok", None)) == ("ok", None)
+
+
+def test_host_mode_shares_result_between_workers(tmp_path):
+    # Two SingleFlight objects over one directory stand in for two worker processes
+    workers = [make_single_flight("host", str(tmp_path)) for _ in range(2)]
+    calls = []
+    results = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return "answer", None
+
+    run_threads(*[lambda w=w: results.append(w.do("q", compute)) for w in workers])
+    assert len(calls) == 1
+    assert results == [("answer", None)] * 2
+    assert sum(w.stats()["shared_across_workers"] for w in workers) == 1
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".lock")]
+
+
+def test_host_mode_different_questions_run_in_parallel(tmp_path):
+    workers = [make_single_flight("host", str(tmp_path)) for _ in range(2)]
+
+    def compute():
+        time.sleep(0.3)
+        return "answer", None
+
+    started = time.perf_counter()
+    # These two keys shared a lock file when locks were striped 64 ways by sha1
+    keys = ("question 0", "question 11")
+    run_threads(*[lambda w=w, key=key: w.do(key, compute) for key, w in zip(keys, workers)])
+    assert time.perf_counter() - started < 0.5
+
+
+def test_async_host_mode_shares_result_between_workers(tmp_path):
+    workers = [make_single_flight("host", str(tmp_path)) for _ in range(2)]
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.2)
+        return "answer", None
+
+    async def scenario():
+        return await asyncio.gather(*[w.ado("q", compute) for w in workers])
+
+    assert asyncio.run(scenario()) == [("answer", None)] * 2
+    assert len(calls) == 1
+
+
+def test_host_lock_wait_is_bounded_by_timeout(tmp_path):
+    holder, waiter = [make_single_flight("host", str(tmp_path), timeout=0.3) for _ in range(2)]
+    calls = []
+
+    def slow():
+        calls.append("holder")
+        time.sleep(1.5)
+        return "slow answer", None
+
+    def fast():
+        calls.append("waiter")
+        return "own answer", None
+
+    thread = threading.Thread(target=lambda: holder.do("q", slow))
+    thread.start()
+    time.sleep(0.1)
+    started = time.perf_counter()
+    assert waiter.do("q", fast) == ("own answer", None)
+    assert time.perf_counter() - started < 1.0
+    assert waiter.stats()["fallbacks"] == 1
+    thread.join()
+    assert calls == ["holder", "waiter"]